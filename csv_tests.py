@@ -1,13 +1,18 @@
 #!/usr/bin/env python3.12
 from argparse import ArgumentParser
 import calendar
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import http.client
+import io
+import json
 import os
 import pandas as pd
 from pathlib import Path
 import sys
-import urllib.request
+import threading
+import urllib.parse
 import time
-from datetime import datetime
 import re
 import apportionment.methods as app  # type: ignore # pip install apportionment
 
@@ -23,59 +28,149 @@ RO_COUNTIES = [
 # fmt: on
 
 
-def download(path: Path, basename: str, url_base: str, county: str | None):
-    now = datetime.now().timestamp()
+MANIFEST = ".download_manifest.json"
+HTTP_DATE = "%a, %d %b %Y %H:%M:%S GMT"
+connections = threading.local()
+
+
+def get_connection(url: urllib.parse.SplitResult):
+    """keep-alive connection of the current thread to the url host"""
+    conn = getattr(connections, "conn", None)
+    if conn and connections.netloc != url.netloc:
+        drop_connection()
+        conn = None
+    if conn is None:
+        if url.scheme == "https":
+            conn = http.client.HTTPSConnection(url.netloc, timeout=30)
+        else:
+            conn = http.client.HTTPConnection(url.netloc, timeout=30)
+        connections.conn, connections.netloc = conn, url.netloc
+    return conn
+
+
+def drop_connection():
+    if conn := getattr(connections, "conn", None):
+        conn.close()
+        connections.conn = None
+
+
+def http_get(url: str, headers: dict) -> tuple[http.client.HTTPResponse, bytes]:
+    for _ in range(5):  # follow the redirects like urlretrieve
+        parts = urllib.parse.urlsplit(url)
+        target = parts.path + (f"?{parts.query}" if parts.query else "")
+        for retry in (True, False):
+            conn = get_connection(parts)
+            try:
+                conn.request("GET", target, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()  # read all, the connection is reused
+                break
+            except Exception as e:
+                # closed keep-alive, timeout.. the connection is unusable
+                drop_connection()
+                if not (retry and isinstance(e, (OSError, http.client.HTTPException))):
+                    raise
+        if resp.status not in (301, 302, 303, 307, 308):
+            return resp, body
+        if not (location := resp.getheader("Location")):
+            return resp, body
+        url = urllib.parse.urljoin(url, location)
+    return resp, body
+
+
+def download_file(f: Path, url: str, state: dict) -> tuple[dict, str | None]:
+    headers = {"Accept-Encoding": "gzip"}
+    if f.exists():
+        if etag := state.get("etag"):
+            headers["If-None-Match"] = etag
+        last_modified = state.get("last_modified") or time.strftime(
+            HTTP_DATE, time.gmtime(f.stat().st_mtime)
+        )
+        headers["If-Modified-Since"] = last_modified
+    else:
+        state = {}
+    error = None
+    for attempt in range(3):
+        if attempt:
+            time.sleep(0.5 * 2**attempt)  # 1s, 2s
+        try:
+            resp, body = http_get(url, headers)
+        except (OSError, http.client.HTTPException) as e:
+            error = f"Could not download {f.name} Error: {e!r}"
+            continue
+        if resp.status == 304:
+            return {k: state[k] for k in ("etag", "last_modified") if k in state}, None
+        if resp.status != 200:
+            error = f"Could not download {f.name} Error: HTTP {resp.status}"
+            if resp.status < 500:
+                break
+            continue
+        if resp.getheader("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        try:
+            pd.read_csv(io.BytesIO(body))  # check valid csv
+        except Exception:
+            error = f"Could not download valid {f.name} ... "
+            print(f"retry {f.name} ... ")
+            continue
+        tmp = f.with_suffix(".tmp")
+        tmp.write_bytes(body)
+        os.replace(tmp, f)
+        state = {}
+        if etag := resp.getheader("ETag"):
+            state["etag"] = etag
+        if last_modified := resp.getheader("Last-Modified"):
+            state["last_modified"] = last_modified
+            mtime = calendar.timegm(time.strptime(last_modified, HTTP_DATE))
+            os.utime(f, (mtime, mtime))
+            print(f"downloaded {f.name} Modified {last_modified}")
+        else:
+            print(f"downloaded {f.name} No Last-Modified header")
+        return state, None
+    return state, error
+
+
+def download(
+    path: Path, basename: str, url_base: str, county: str | None, workers: int = 8
+):
+    start = time.perf_counter()
     if county:
         files = [f"{county}.csv"]
     else:
         files = [basename + county + ".csv" for county in RO_COUNTIES]
-    for filename in files:
-        f = path / filename
-        file_mtime = None
-        if f.exists():
-            file_mtime = f.stat().st_mtime
-        if not file_mtime or now - file_mtime > 60:
-            opener = urllib.request.build_opener()
-            if file_mtime:
-                timestr = time.strftime(
-                    "%a, %d %b %Y %H:%M:%S GMT", time.gmtime(file_mtime)
-                )
-                # print(f"downloading {f.name} modified since {timestr} ...")
-                opener.addheaders.append(("If-Modified-Since", timestr))
-            else:
-                print(f"downloading new {f.name} ... ")
-            urllib.request.install_opener(opener)
-            for _ in range(3):
-                try:
-                    _, headers = urllib.request.urlretrieve(url_base + filename, f)
-                except urllib.error.HTTPError as e:
-                    if e.code != 304:
-                        print(f"Could not download {f.name} Error: {e}")
-                    break
-                try:
-                    pd.read_csv(f)  # check valid csv
-                    if "Last-Modified" in headers:
-                        mtime = calendar.timegm(
-                            time.strptime(
-                                headers["Last-Modified"],
-                                "%a, %d %b %Y %H:%M:%S GMT",
-                            )
-                        )
-                        os.utime(f, (mtime, mtime))
-                        print(
-                            f"downloaded {f.name} Modified {headers['Last-Modified']}"
-                        )
-                    else:
-                        print(f"downloaded {f.name} No Last-Modified header")
-                    time.sleep(0.2)
-                    break
-                except:  # invalid csv, sleep and retry
-                    print(f"retry {f.name} ... ")
-                    f.unlink()
-                    time.sleep(10)
-            else:
-                print(f"ERROR: Could not download valid {f.name} ... ")
-            urllib.request.install_opener(urllib.request.build_opener())
+    path.mkdir(parents=True, exist_ok=True)
+    manifest_file = path / MANIFEST
+    try:
+        manifest = json.loads(manifest_file.read_text())
+    except (OSError, ValueError):
+        manifest = {}
+    now = time.time()
+    # files failing in the previous cycles wait 1, 2, 4 .. 16 minutes
+    files = [fn for fn in files if manifest.get(fn, {}).get("retry_at", 0) <= now]
+    with ThreadPoolExecutor(workers) as pool:
+        futures = {
+            fn: pool.submit(
+                download_file, path / fn, url_base + fn, manifest.get(fn, {})
+            )
+            for fn in files
+        }
+    errors = 0
+    for fn, future in futures.items():
+        state, error = future.result()
+        if error:
+            errors += 1
+            failures = manifest.get(fn, {}).get("failures", 0) + 1
+            state |= {"failures": failures}
+            state["retry_at"] = time.time() + 60 * 2 ** min(failures - 1, 4)
+            print(f"ERROR: {error}")
+        manifest[fn] = state
+    tmp = manifest_file.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=1))
+    os.replace(tmp, manifest_file)
+    print(
+        f"download cycle of {len(files)} files in"
+        f" {time.perf_counter() - start:.2f}s, {errors} errors"
+    )
 
 
 def run(path: Path, basename: str, seats: int, county: str | None, filter: str | None):
@@ -124,6 +219,9 @@ def parse_args():
         help="base url for csv files download",
     )
     parser.add_argument("--no-download", action="store_true", help="disable download")
+    parser.add_argument(
+        "--download-workers", default=8, help="parallel downloads", type=int
+    )
     parser.add_argument("--seats", default=100, help="number of seats", type=int)
     parser.add_argument("--filter", default=None, help="pandas filter expression")
 
@@ -136,5 +234,7 @@ if __name__ == "__main__":
     pd.options.display.float_format = "{:.1f}".format
     args = parse_args()
     if args.url and not args.no_download:
-        download(args.path, args.basename, args.url, args.county)
+        download(
+            args.path, args.basename, args.url, args.county, args.download_workers
+        )
     run(args.path, args.basename, args.seats, args.county, args.filter)
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3.12
+import asyncio
+import base64
+import csv
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import random
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class Latency:
+    """Response delay in ms: const:5, uniform:2,20, lognormal:mu,sigma or exp:mean"""
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        match kind:
+            case "const" | "exp":
+                if len(self.params) != 1:
+                    raise ValueError(f"latency {spec} needs 1 parameter")
+            case "uniform" | "lognormal":
+                if len(self.params) != 2:
+                    raise ValueError(f"latency {spec} needs 2 parameters")
+            case _:
+                raise ValueError(f"unknown latency distribution {kind}")
+
+    def sample(self) -> float:
+        match self.kind:
+            case "const":
+                ms = self.params[0]
+            case "exp":
+                ms = random.expovariate(1 / self.params[0]) if self.params[0] else 0
+            case "uniform":
+                ms = random.uniform(*self.params)
+            case "lognormal":
+                ms = random.lognormvariate(*self.params)
+        return ms / 1000
+
+
+class MockStats:
+    def __init__(self):
+        self.requests = 0
+        self.ws_messages = 0
+        self.ws_connections = 0
+        self.peak_rps = 0.0
+        self.peak_ws_mps = 0.0
+
+    async def report(self, interval: float):
+        last = (time.monotonic(), self.requests, self.ws_messages)
+        while True:
+            await asyncio.sleep(interval)
+            now = (time.monotonic(), self.requests, self.ws_messages)
+            elapsed = now[0] - last[0]
+            rps = (now[1] - last[1]) / elapsed
+            ws_mps = (now[2] - last[2]) / elapsed
+            self.peak_rps = max(self.peak_rps, rps)
+            self.peak_ws_mps = max(self.peak_ws_mps, ws_mps)
+            if rps or ws_mps:
+                logging.info(
+                    f"req/s {rps:.0f} ws msg/s {ws_mps:.0f}"
+                    f" ws connections {self.ws_connections}"
+                )
+            last = now
+
+
+class DCCMockServer:
+    """Stand-in for the Admin and DCC servers api.pts / api.ws endpoints
+
+    Both servers are served on the same address, ChooseLicense returns it
+    as AddressSSL so DCCUser talks to this process only.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.latency = Latency(args.latency)
+        self.stats = MockStats()
+        self.address = f"{args.public_host or args.host}:{args.port}"
+        self.instance_guid = str(uuid4())
+        self.instance_name = args.instance_name
+        self.ssl_context = None
+        if args.certfile:
+            self.ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            self.ssl_context.load_cert_chain(args.certfile, args.keyfile)
+        row = {"ID": 0, "Data": "x" * max(args.row_size - 20, 0)}
+        self.row = json.dumps(row).encode()
+        self.pages: dict[int, bytes] = {}
+        self.event = json.dumps(
+            {
+                "Type": "Event",
+                "ObjectType": "Routing",
+                "ObjectName": "Activities",
+                "EventType": "StateChanged",
+                "Data": "x" * args.ws_event_size,
+            }
+        ).encode()
+
+    async def serve(self):
+        server = await asyncio.start_server(
+            self.handle, self.args.host, self.args.port, ssl=self.ssl_context
+        )
+        scheme = "https" if self.ssl_context else "http"
+        logging.info(f"DCC mock listening on {scheme}://{self.address}")
+        asyncio.create_task(self.stats.report(self.args.report_interval))
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    k, _, v = line.decode().partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                body = b""
+                if length := int(headers.get("content-length", 0)):
+                    body = await reader.readexactly(length)
+                url = urlsplit(target)
+                upgrade = headers.get("upgrade", "").lower()
+                if url.path == "/api.ws" and upgrade == "websocket":
+                    await self.websocket(reader, writer, headers)
+                    break
+                self.stats.requests += 1
+                await asyncio.sleep(self.latency.sample())
+                status, payload = self.api(url, body)
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                )
+                writer.write(payload)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logging.debug(f"connection error {e!r}")
+        finally:
+            writer.close()
+
+    def api(self, url, body: bytes) -> tuple[str, bytes]:
+        query = parse_qs(url.query)
+        otype = query.get("otype", [""])[0]
+        method = query.get("method", [""])[0]
+        try:
+            req = json.loads(body) if body else {}
+        except json.JSONDecodeError:
+            return "400 Bad Request", b'{"Error":"invalid json"}'
+        match otype, method:
+            case "Admin.Users", "PoltysConnect":
+                res = {
+                    "Token": str(uuid4()),
+                    "TokenGlobal": str(uuid4()),
+                    "Licenses": [
+                        {
+                            "Admin::LicensesKey": {
+                                "Key": self.instance_guid,
+                                "Name": self.instance_name,
+                            }
+                        }
+                    ],
+                }
+            case "Admin.MainServer", "ChooseLicense":
+                res = {
+                    "AddressSSL": self.address,
+                    "Token": str(uuid4()),
+                    "ComputerGUID": str(uuid4()),
+                }
+            case "Admin.Users", "Disconnect":
+                res = {}
+            case "Utils.Miscellaneous", "GetProcessInfo":
+                res = {"PID": os.getpid()}
+            case _, "Count" | "ActiveCount" | "CountResidents":
+                res = {"Count": self.args.rows}
+            case _, (
+                "List"
+                | "ActiveList"
+                | "ListResidents"
+                | "ListEmployees"
+                | "AvailableList"
+                | "GetActiveAlarmsEndpoints"
+            ):
+                start = req.get("Start", 0) if isinstance(req, dict) else 0
+                length = req.get("Length", 100) if isinstance(req, dict) else 100
+                return "200 OK", self.page(max(min(length, self.args.rows - start), 0))
+            case _:
+                return "404 Not Found", b'{"Error":"unknown method"}'
+        return "200 OK", json.dumps(res).encode()
+
+    def page(self, rows: int) -> bytes:
+        if rows not in self.pages:
+            self.pages[rows] = (
+                b'{"Count":%d,"Rows":[' % rows + b",".join([self.row] * rows) + b"]}"
+            )
+        return self.pages[rows]
+
+    async def websocket(self, reader, writer, headers):
+        accept = base64.b64encode(
+            hashlib.sha1(headers["sec-websocket-key"].encode() + WS_GUID).digest()
+        )
+        writer.write(
+            b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+            b"Connection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+        )
+        await writer.drain()
+        self.stats.ws_connections += 1
+        pusher = asyncio.create_task(self.ws_push(writer))
+        try:
+            while True:
+                opcode, payload = await self.ws_read_frame(reader)
+                if opcode == 0x8:
+                    writer.write(self.ws_frame(payload, 0x8))
+                    break
+                if opcode == 0x9:
+                    writer.write(self.ws_frame(payload, 0xA))
+                elif opcode == 0x1 and b"ConnectBulk" in payload:
+                    writer.write(self.ws_frame(b'{"Response":{"Result":true}}'))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            pusher.cancel()
+            self.stats.ws_connections -= 1
+
+    async def ws_push(self, writer):
+        event = self.ws_frame(self.event)
+        keepalive = self.ws_frame(b'{"KeepAlive":true}')
+        next_keepalive = time.monotonic() + self.args.ws_keepalive
+        period = 1 / self.args.ws_rate if self.args.ws_rate else self.args.ws_keepalive
+        while True:
+            await asyncio.sleep(random.expovariate(1 / period))
+            if time.monotonic() >= next_keepalive:
+                writer.write(keepalive)
+                next_keepalive += self.args.ws_keepalive
+            elif self.args.ws_rate:
+                writer.write(event)
+            else:
+                continue
+            self.stats.ws_messages += 1
+            await writer.drain()
+
+    @staticmethod
+    async def ws_read_frame(reader) -> tuple[int, bytes]:
+        b0, b1 = await reader.readexactly(2)
+        length = b1 & 0x7F
+        if length == 126:
+            length = int.from_bytes(await reader.readexactly(2))
+        elif length == 127:
+            length = int.from_bytes(await reader.readexactly(8))
+        mask = await reader.readexactly(4) if b1 & 0x80 else None
+        payload = await reader.readexactly(length)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return b0 & 0x0F, payload
+
+    @staticmethod
+    def ws_frame(payload: bytes, opcode=0x1) -> bytes:
+        length = len(payload)
+        if length < 126:
+            header = bytes([0x80 | opcode, length])
+        elif length < 1 << 16:
+            header = bytes([0x80 | opcode, 126]) + length.to_bytes(2)
+        else:
+            header = bytes([0x80 | opcode, 127]) + length.to_bytes(8)
+        return header + payload
+
+    @staticmethod
+    def parse_args():
+        parser = ArgumentParser(
+            description=f"{pathlib.Path(__file__).name} argument parser"
+        )
+        parser.add_argument("--host", default="127.0.0.1", help="listen address")
+        parser.add_argument("--port", default=8443, type=int, help="listen port")
+        parser.add_argument(
+            "--public-host", help="host returned to clients as AddressSSL"
+        )
+        parser.add_argument("--certfile", help="TLS certificate, plain http without")
+        parser.add_argument("--keyfile", help="TLS private key")
+        parser.add_argument("--instance-name", default="MOCK", help="DCC instance")
+        parser.add_argument(
+            "--latency",
+            default="const:0",
+            help="response delay ms: const:5, uniform:2,20, lognormal:mu,sigma, exp:m",
+        )
+        parser.add_argument("--rows", default=1000, type=int, help="rows per table")
+        parser.add_argument("--row-size", default=200, type=int, help="bytes per row")
+        parser.add_argument(
+            "--ws-rate", default=1.0, type=float, help="events/s per websocket"
+        )
+        parser.add_argument(
+            "--ws-event-size", default=200, type=int, help="event payload bytes"
+        )
+        parser.add_argument(
+            "--ws-keepalive", default=10.0, type=float, help="KeepAlive period s"
+        )
+        parser.add_argument(
+            "--report-interval", default=5.0, type=float, help="stats period s"
+        )
+        parser.add_argument(
+            "--bench",
+            help="benchmark locustfile.py with these user counts (ex. 100,500,1000)",
+        )
+        parser.add_argument("--bench-time", default="60s", help="run time per step")
+        parser.add_argument("--bench-tags", help="locust --tags for the benchmark")
+        return parser.parse_args()
+
+
+class GeneratorBenchmark:
+    """Runs one locust process (one core) per user count against the mock
+    and reports the sustained generator req/s and websocket msg/s."""
+
+    def __init__(self, server: DCCMockServer):
+        self.server = server
+        self.args = server.args
+
+    async def run(self):
+        asyncio.create_task(self.server.serve())
+        await asyncio.sleep(0.5)
+        results = []
+        with tempfile.TemporaryDirectory() as tmp:
+            cfg = pathlib.Path(tmp) / "locustcfg.toml"
+            cfg.write_text(
+                f'admin_api_host = "{self.server.address}"\n'
+                f'api_scheme = "{"https" if self.server.ssl_context else "http"}"\n'
+                f'dcc_instance_name = "{self.args.instance_name}"\n'
+                'dcc_user = "bench"\ndcc_password = "bench"\n'
+            )
+            for users in [int(u) for u in self.args.bench.split(",")]:
+                results.append((users, *await self.step(tmp, cfg, users)))
+        print(f"{'users':>8} {'req/s':>10} {'ws msg/s':>10} {'failures':>10}")
+        for users, rps, ws_mps, failures in results:
+            print(f"{users:>8} {rps:>10.1f} {ws_mps:>10.1f} {failures:>10}")
+        best = max(results, key=lambda r: r[1] if not r[3] else 0)
+        print(f"max sustained per core: {best[1]:.1f} req/s at {best[0]} users")
+
+    async def step(self, tmp, cfg, users: int):
+        prefix = pathlib.Path(tmp) / f"bench_{users}"
+        cmd = [
+            "locust",
+            "-f",
+            str(pathlib.Path(__file__).with_name("locustfile.py")),
+            "--headless",
+            "-u",
+            str(users),
+            "-r",
+            str(max(users // 10, 1)),
+            "-t",
+            self.args.bench_time,
+            "--csv",
+            str(prefix),
+            "--only-summary",
+        ]
+        if self.args.bench_tags:
+            cmd += ["--tags", *self.args.bench_tags.split(",")]
+        logging.info(" ".join(cmd))
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, env=os.environ | {"LOCUSTCFG": str(cfg)}, stdout=subprocess.DEVNULL
+        )
+        await proc.wait()
+        rps = ws_mps = 0.0
+        failures = 0
+        with open(f"{prefix}_stats.csv") as f:
+            for row in csv.DictReader(f):
+                if row["Name"] == "Aggregated":
+                    failures = int(row["Failure Count"])
+                elif row["Type"] == "WSR":
+                    ws_mps += float(row["Requests/s"])
+                elif row["Type"] not in ("WS", "PAGE", "TTFB", "TLS"):
+                    rps += float(row["Requests/s"])
+        return rps, ws_mps, failures
+
+
+def main():
+    logging.basicConfig(
+        format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO
+    )
+    args = DCCMockServer.parse_args()
+    server = DCCMockServer(args)
+    try:
+        if args.bench:
+            asyncio.run(GeneratorBenchmark(server).run())
+        else:
+            asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        print("\nCtrl-C Received. EXIT.")
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,43 @@
+import base64
+import csv
+import functools
+import gzip
+import itertools
 import logging
+import os
+import pathlib
 import re
+import selectors
+import ssl
+import sys
 import time
+import zlib
 import gevent
-from locust import User, tag, task, run_single_user
-from locust import FastHttpUser
+import gevent.pool
+import gevent.ssl
+from gevent.event import Event
+from gevent.selectors import GeventSelector
+from geventhttpclient.client import HTTPClientPool
+from locust import User, events, tag, task, run_single_user
+from locust import FastHttpUser, LoadTestShape
+from locust.runners import MasterRunner, WorkerRunner
+from locust.stats import (
+    CURRENT_RESPONSE_TIME_PERCENTILE_WINDOW,
+    calculate_response_time_percentile,
+    diff_response_time_dicts,
+)
 import tomllib
 import json
+from collections import Counter, OrderedDict
+from urllib.parse import parse_qs, urlsplit
 from uuid import UUID, uuid4
 import websocket  # pip install websocket-client
 
+try:
+    from orjson import loads as ws_loads  # pip install orjson
+except ImportError:
+    from json import loads as ws_loads
+
 from datetime import datetime, timedelta
 
 
@@ -19,36 +48,783 @@ def datetime_to_excel(dt):
     return float(delta.days) + (float(delta.seconds) / 86400)
 
 
-def get_toml_cfg(self):
-    with open("locustcfg.toml", "rb") as f:
-        cfg = tomllib.load(f)
-        for k in cfg:
-            logging.debug(f"{self.__class__.__name__}.{k}= {cfg[k]}")
-            setattr(self, k, cfg[k])
+class DCCConfig:
+    """locustcfg.toml loader, parsed once per process.
 
+    Top level keys become class level defaults of the user class, a `users`
+    array of tables holds per user overrides (ex. credentials) handed out
+    round-robin, other tables are sections for the load shape, etc.
+    """
 
-class DCCWebSocket:
+    filename = os.environ.get("LOCUSTCFG", "locustcfg.toml")
+    cfg: dict | None = None
+    applied: set[type] = set()
+    overrides: dict[type, itertools.cycle] = {}
 
-    def ws_connect(self, host: str, header=[], **kwargs):
-        self.ws = websocket.create_connection(host, header=header, **kwargs)
-        self.ws_greenlet = gevent.spawn(self.ws_receive_loop)
+    @classmethod
+    def load(cls) -> dict:
+        if cls.cfg is None:
+            try:
+                with open(cls.filename, "rb") as f:
+                    cls.cfg = tomllib.load(f)
+            except FileNotFoundError:
+                logging.warning(f"Config file {cls.filename} not found")
+                cls.cfg = {}
+        return cls.cfg
+
+    @classmethod
+    def section(cls, name: str) -> dict:
+        return cls.load().get(name, {})
+
+    @staticmethod
+    def valid_items(user_class: type, items: dict):
+        for k, v in items.items():
+            if not hasattr(user_class, k) or k.startswith("_"):
+                logging.warning(f"{user_class.__name__} has no config key '{k}'")
+                continue
+            default = getattr(user_class, k)
+            if default is None:
+                valid = True
+            elif isinstance(default, bool) or isinstance(v, bool):
+                valid = type(v) is type(default)  # bool is an int subclass
+            elif isinstance(default, float):
+                valid = isinstance(v, (int, float))
+            else:
+                valid = isinstance(v, type(default))
+            if not valid:
+                expects = type(default).__name__
+                logging.warning(
+                    f"{user_class.__name__}.{k} expects {expects} got {v!r}"
+                )
+                continue
+            yield k, v
+
+    @classmethod
+    def apply_class(cls, user_class: type, offset: int = 0):
+        if user_class in cls.applied:
+            return
+        cls.applied.add(user_class)
+        for k, v in cls.load().items():
+            if k == "users":
+                users = [dict(cls.valid_items(user_class, u)) for u in v]
+                if users:
+                    offset %= len(users)
+                    cls.overrides[user_class] = itertools.cycle(
+                        users[offset:] + users[:offset]
+                    )
+            elif isinstance(v, dict):
+                continue  # section
+            else:
+                for k, v in cls.valid_items(user_class, {k: v}):
+                    logging.debug(f"{user_class.__name__}.{k}= {v}")
+                    setattr(user_class, k, v)
+
+    @classmethod
+    def apply(cls, user):
+        cls.apply_class(type(user))
+        if users := cls.overrides.get(type(user)):
+            for k, v in next(users).items():
+                setattr(user, k, v)
+
+
+def ws_flag(message: str, key: str) -> bool:
+    # '"KeepAlive": true' without decoding, false/null/0/empty values are not set
+    i = message.find(key, 0, 256)
+    if i < 0:
+        return False
+    value = message[i + len(key) : i + len(key) + 8].lstrip(" :")
+    return not value.startswith(("false", "null", "0", '""', "{}", "[]"))
+
+
+def ws_frame_kind(message) -> str:
+    """Classify a DCC websocket frame with a byte scan instead of json.loads
+
+    Returns "KeepAlive", "Response", the event EventType or "Event".
+    """
+    if not isinstance(message, str):
+        return "binary"
+    if ws_flag(message, '"KeepAlive"'):
+        return "KeepAlive"
+    if ws_flag(message, '"Response"'):
+        return "Response"
+    i = message.find('"EventType"')
+    if i >= 0:
+        start = message.find('"', i + 11) + 1
+        end = message.find('"', start)
+        if 0 < start < end:
+            return message[start:end]
+    return "Event"
+
+
+class DCCWsConnection:
+    """Websocket client connection read by DCCWebSocketEngine.
 
-    def ws_receive_loop(self):
+    The handshake is done by websocket-client, received frames are parsed
+    here so partial frames never block the engine and permessage-deflate
+    compressed messages can be inflated.
+    """
+
+    def __init__(self, engine, user, ws, extensions: str):
+        self.engine = engine
+        self.user = user
+        self.ws = ws
+        self.sock = ws.sock
+        self.buffer = bytearray()
+        self.fragments: list[bytes] = []
+        self.opcode = 0
+        self.compressed = False
+        self.inflater = None
+        self.inflater_reset = False
+        if "permessage-deflate" in extensions:
+            self.inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+            self.inflater_reset = "server_no_context_takeover" in extensions
+        self.closed = False
+
+    def send(self, body, opcode=websocket.ABNF.OPCODE_TEXT):
+        if not self.closed:
+            self.ws.send(body, opcode)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.engine.closing.append(self)
+
+    def feed(self, data: bytes):
+        buf = self.buffer
+        buf += data
+        while len(buf) >= 2:
+            fin = buf[0] & 0x80
+            rsv1 = buf[0] & 0x40
+            opcode = buf[0] & 0x0F
+            masked = buf[1] & 0x80
+            length = buf[1] & 0x7F
+            pos = 2
+            if length == 126:
+                if len(buf) < 4:
+                    return
+                length = int.from_bytes(buf[2:4])
+                pos = 4
+            elif length == 127:
+                if len(buf) < 10:
+                    return
+                length = int.from_bytes(buf[2:10])
+                pos = 10
+            if masked:
+                mask = buf[pos : pos + 4]
+                pos += 4
+            if len(buf) < pos + length:
+                return
+            payload = bytes(buf[pos : pos + length])
+            del buf[: pos + length]
+            if masked:  # servers must not mask, handle it anyway
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+            if opcode >= websocket.ABNF.OPCODE_CLOSE:
+                self.on_control(opcode, payload)
+                continue
+            if opcode != websocket.ABNF.OPCODE_CONT:
+                self.opcode = opcode
+                self.compressed = bool(rsv1) and self.inflater is not None
+                self.fragments = []
+            self.fragments.append(payload)
+            if fin:
+                message = b"".join(self.fragments)
+                self.fragments = []
+                if self.compressed:
+                    message = self.inflater.decompress(message + b"\x00\x00\xff\xff")
+                    if self.inflater_reset:
+                        self.inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+                length = len(message)
+                if self.opcode == websocket.ABNF.OPCODE_TEXT:
+                    message = message.decode()
+                name = self.user.ws_on_message(message)
+                self.engine.fire("WSR", name or "message", length, self.user)
+
+    def on_control(self, opcode, payload):
+        if opcode == websocket.ABNF.OPCODE_PING:
+            self.ws.pong(payload)
+        elif opcode == websocket.ABNF.OPCODE_CLOSE:
+            self.close()
+
+
+class DCCWebSocketEngine:
+    """One greenlet receiving for all the websockets of this process.
+
+    Sockets are multiplexed with a gevent selector instead of one blocking
+    recv greenlet per user. Connect time, received messages/bytes and
+    failures are reported as Locust requests of type WS / WSR.
+    """
+
+    instance: "DCCWebSocketEngine | None" = None
+    select_timeout = 0.2
+
+    def __init__(self, environment):
+        self.environment = environment
+        self.selector = GeventSelector()
+        self.opening: list[DCCWsConnection] = []
+        self.closing: list[DCCWsConnection] = []
+        self.greenlet = gevent.spawn(self.run)
+
+    @classmethod
+    def get(cls, environment) -> "DCCWebSocketEngine":
+        if cls.instance is None or cls.instance.greenlet.dead:
+            cls.instance = cls(environment)
+        return cls.instance
+
+    def fire(
+        self, request_type, name, length, user, response_time=0, exception=None
+    ):
+        self.environment.events.request.fire(
+            request_type=request_type,
+            name=name,
+            response_time=response_time,
+            response_length=length,
+            exception=exception,
+            context=user.context(),
+        )
+
+    def connect(self, user, url: str, header: list, deflate=False, **kwargs):
+        if deflate:
+            header = header + [
+                "Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits"
+            ]
+        start = time.perf_counter()
+        try:
+            ws = websocket.create_connection(
+                url, header=header, enable_multithread=True, **kwargs
+            )
+        except Exception as e:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.fire("WS", "connect", 0, user, elapsed, e)
+            return None
+        elapsed = (time.perf_counter() - start) * 1000
+        self.fire("WS", "connect", 0, user, elapsed)
+        headers = ws.getheaders() or {}
+        conn = DCCWsConnection(
+            self, user, ws, headers.get("sec-websocket-extensions", "")
+        )
+        self.opening.append(conn)
+        return conn
+
+    def run(self):
         while True:
+            # (un)register only from this greenlet, never while selecting
+            while self.opening:
+                conn = self.opening.pop()
+                if not conn.closed:
+                    self.selector.register(conn.sock, selectors.EVENT_READ, conn)
+            while self.closing:
+                conn = self.closing.pop()
+                if conn.sock in self.selector.get_map():
+                    self.selector.unregister(conn.sock)
+                gevent.spawn(conn.ws.close, timeout=1)
+            if not self.selector.get_map():
+                gevent.sleep(self.select_timeout)
+                continue
+            for key, _ in self.selector.select(self.select_timeout):
+                self.receive(key.data)
+
+    def receive(self, conn: DCCWsConnection):
+        sock = conn.sock
+        try:
+            # select reports a partial TLS record as readable, a blocking recv
+            # would then stall every websocket of the process; no greenlet can
+            # run before the timeout is restored so the senders never see it
+            timeout = sock.gettimeout()
+            sock.settimeout(0)
             try:
-                message = self.ws.recv()
-                logging.debug(f"WSR: {message}")
-                self.ws_on_message(message)
-            except:
-                break
+                data = sock.recv(65536)
+                # TLS records already decrypted are not seen by select
+                while data and getattr(sock, "pending", None) and sock.pending():
+                    data += sock.recv(65536)
+            finally:
+                sock.settimeout(timeout)
+            if not data:
+                raise ConnectionError("websocket closed by server")
+            conn.feed(data)
+        except (ssl.SSLWantReadError, BlockingIOError):
+            pass  # no complete data yet
+        except Exception as e:
+            if not conn.closed:
+                self.fire("WS", "recv", 0, conn.user, exception=e)
+                conn.close()
+
+
+class DCCWebSocket:
+    ws: DCCWsConnection | None = None
+    ws_deflate = False
+
+    def ws_connect(self, host: str, header=[], **kwargs):
+        engine = DCCWebSocketEngine.get(self.environment)
+        self.ws = engine.connect(self, host, header, self.ws_deflate, **kwargs)
 
     def ws_send(self, body, name=None, context={}, opcode=websocket.ABNF.OPCODE_TEXT):
         logging.debug(f"WSS: {body}")
-        self.ws.send(body, opcode)
+        if self.ws:
+            self.ws.send(body, opcode)
+
+
+class DCCSession:
+    fields = (
+        "admin_api_host",
+        "admin_token_global",
+        "admin_token",
+        "dcc_instance_guid",
+        "dcc_instance_name",
+        "computer_guid",
+        "dcc_api_host",
+        "dcc_token",
+        "pid",
+    )
+
+    def __init__(self):
+        self.values = {}
+        self.users = set()
+        self.expires = 0.0
+        self.ready = Event()
+
+    @property
+    def valid(self) -> bool:
+        return bool(self.values.get("pid"))
+
+    def capture(self, user, ttl: float):
+        self.values = {k: getattr(user, k) for k in self.fields}
+        self.expires = time.monotonic() + ttl
+
+    def apply(self, user):
+        for k, v in self.values.items():
+            setattr(user, k, v)
+
+
+class DCCSessionPool:
+    """Shares a bounded number of logged in DCC sessions between the users of
+    one login (host, credentials and instance).
+
+    The first users to start run the login handshake and fill the pool, the
+    following ones attach to the least used session. Expired sessions are
+    refreshed by a single greenlet with the client of one of their users and
+    the new token/pid is pushed to every user holding the session.
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.sessions: list[DCCSession] = []
+        self.refresh_greenlet = None
+
+    def acquire(self, user) -> DCCSession | None:
+        if len(self.sessions) < self.size:
+            session = DCCSession()
+            self.sessions.append(session)
+            session.users.add(user)
+            try:
+                if user.dcc_login():
+                    session.capture(user, self.ttl)
+            finally:
+                session.ready.set()
+            if not session.valid:
+                session.users.discard(user)
+                self.sessions.remove(session)
+                return None
+            logging.info(f"Session pool {len(self.sessions)}/{self.size} logged in")
+            if self.refresh_greenlet is None or self.refresh_greenlet.dead:
+                self.refresh_greenlet = gevent.spawn(self.refresh_loop)
+            return session
+        # reserve the slot before waiting so the users arriving during the login
+        # spread over the sessions instead of all picking the first one
+        session = min(self.sessions, key=lambda s: len(s.users))
+        session.users.add(user)
+        try:
+            session.ready.wait()
+        except BaseException:
+            session.users.discard(user)
+            raise
+        if not session.valid:
+            session.users.discard(user)
+            return None
+        session.apply(user)
+        return session
+
+    def release(self, session: DCCSession, user) -> bool:
+        """True when user was the last holder of session and has to log it out"""
+        session.users.discard(user)
+        if session.users:
+            return False
+        if session in self.sessions:
+            self.sessions.remove(session)
+        return True
+
+    def refresh_loop(self):
+        while self.sessions:
+            gevent.sleep(min(self.ttl / 10, 60))
+            now = time.monotonic()
+            for session in list(self.sessions):
+                # ready is clear while the first login or a refresh is running
+                if session.expires <= now and session.users and session.ready.is_set():
+                    self.refresh(session)
+
+    def refresh(self, session: DCCSession):
+        user = next(iter(session.users))
+        session.ready.clear()
+        try:
+            logging.info(f"{user.uuid} Refresh expired pool session")
+            old_token = session.values.get("admin_token_global")
+            user.dcc_token = None
+            user.pid = None
+            if user.dcc_login():
+                session.capture(user, self.ttl)
+                for u in session.users:
+                    session.apply(u)
+                # the users hold the new token, drop the server side login
+                if old_token and old_token != user.admin_token_global:
+                    user.dcc_logout(old_token)
+            else:
+                session.apply(user)
+                session.expires = time.monotonic() + self.ttl / 10
+        finally:
+            session.ready.set()
+
+
+class DCCRequest:
+    """DCC api.pts call with its JSON body serialized once at import"""
+
+    registry: dict[str, "DCCRequest"] = {}
+
+    def __init__(
+        self, name: str, otype: str, method: str, body: dict | None = None, pid=True
+    ):
+        self.name = name
+        self.fields = body or {}
+        self.body = json.dumps(self.fields).encode()
+        self.query = f"/api.pts?otype={otype}&method={method}&token="
+        self.pid = pid
+        DCCRequest.registry[name] = self
+
+    def page(self, start: int, length: int) -> bytes:
+        return json.dumps(self.fields | {"Start": start, "Length": length}).encode()
+
+    def url(self, base, token, pid) -> str:
+        if self.pid:
+            return f"{base}{self.query}{token}&pid={pid}"
+        return f"{base}{self.query}{token}"
+
+
+ALARMS_HAVING = "(JSON_SEARCH({15}, 'one', '%') IS NULL OR JSON_CONTAINS({15}, '[\"BUILDING\"]') OR JSON_CONTAINS({15}, '[\"Special\"]')) AND (JSON_SEARCH({16}, 'one', '%') IS NULL OR JSON_CONTAINS({16}, '[\"Caregiver\"]'))"
+DEVICES_CONDITION = "({1} LIKE '%11%' OR {2} LIKE '%11%' OR {13} LIKE '%11%' OR {3} LIKE '%11%' OR {4} LIKE '%11%' OR {5} LIKE '%11%' OR {6} LIKE '%11%' OR {9} LIKE '%11%' OR {10} LIKE '%11%')"
+
+DCCRequest("SingleProcessInfo", "Utils.Miscellaneous", "GetProcessInfo", pid=False)
+DCCRequest("WebSocket:Connect", "Utils.Miscellaneous", "GetProcessInfo", pid=False)
+DCCRequest(
+    "Devices.Endpoints:Count",
+    "Devices.Endpoints",
+    "Count",
+    {"Condition": DEVICES_CONDITION, "Line": "Sim Residents"},
+)
+DCCRequest(
+    "Devices.Endpoints:List",
+    "Devices.Endpoints",
+    "List",
+    {
+        "Start": 0,
+        "Length": 20,
+        "OrderC": [6, 2],
+        "OrderT": ["ASC", "ASC"],
+        "Condition": DEVICES_CONDITION
+        + " AND  EndpointTypes.Name != 'LineMaintenance'  AND Lines_.Name = 'Sim Residents'",
+        "Having": "",
+    },
+)
+DCCRequest(
+    "DCC::Alarms:ActiveCount",
+    "DCC::Alarms",
+    "ActiveCount",
+    {"Condition": "", "Having": ALARMS_HAVING, "Version": 1},
+)
+DCCRequest(
+    "DCC::Alarms:GetActiveAlarmsEndpoints", "DCC::Alarms", "GetActiveAlarmsEndpoints"
+)
+DCCRequest(
+    "DCC::Alarms:ActiveList",
+    "DCC::Alarms",
+    "ActiveList",
+    {
+        "Version": 1,
+        "Start": 0,
+        "Length": 300,
+        "OrderC": [],
+        "OrderT": [],
+        "Condition": "",
+        "Having": ALARMS_HAVING,
+    },
+)
+DCCRequest(
+    "DCC::Logins:AvailableList",
+    "DCC::Logins",
+    "AvailableList",
+    {
+        "Locations": ["<empty>", "BUILDING", "Special"],
+        "Competences": ["<empty>", "Caregiver"],
+        "Shift": "Day",
+    },
+)
+DCCRequest(
+    "DCC::Checkins:ActiveList",
+    "DCC::Checkins",
+    "ActiveList",
+    {
+        "Start": 0,
+        "Length": 300,
+        "OrderC": [1],
+        "OrderT": ["ASC"],
+        "Condition": "",
+        "Having": "(JSON_SEARCH({6}, 'one', '%') IS NULL OR JSON_CONTAINS({6}, '[\"BUILDING\"]') OR JSON_CONTAINS({6}, '[\"Special\"]'))",
+    },
+)
+for name, condition, having in (
+    (
+        " - 24H",
+        "({1} > DATE_SUB(@currTimeUTC, INTERVAL 24 HOUR))",
+        "(JSON_SEARCH({20}, 'one', '%') IS NULL OR JSON_CONTAINS({20}, '[\"BUILDING\"]')) AND (JSON_SEARCH({21}, 'one', '%') IS NULL OR JSON_CONTAINS({21}, '[\"Caregiver\"]'))",
+    ),
+    (" - 1MON", "({1} > DATE_SUB(@currTimeUTC, INTERVAL 1 MONTH))", None),
+):
+    DCCRequest(
+        "DCC::Alarms:Count" + name,
+        "DCC::Alarms",
+        "Count",
+        {"Condition": condition, "Having": having, "FromArchive": False},
+    )
+    DCCRequest(
+        "DCC::Alarms:List" + name,
+        "DCC::Alarms",
+        "List",
+        {
+            "Start": 0,
+            "Length": 100,
+            "OrderC": [1],
+            "OrderT": ["DESC"],
+            "Condition": condition,
+            "Having": having,
+            "FromArchive": False,
+        },
+    )
+DCCRequest(
+    "DCC.Contacts:ResidentsCount",
+    "DCC.Contacts",
+    "CountResidents",
+    {"Condition": "", "Having": ""},
+)
+DCCRequest(
+    "DCC.Contacts:ResidentsList",
+    "DCC.Contacts",
+    "ListResidents",
+    {
+        "Start": 0,
+        "Length": 100,
+        "OrderC": [1],
+        "OrderT": ["ASC"],
+        "Condition": "",
+        "Having": "",
+    },
+)
+DCCRequest(
+    "DCC.Contacts:EmployeesCount",
+    "DCC.Contacts",
+    "ListEmployees",
+    {"Condition": "", "Having": ""},
+)
+DCCRequest(
+    "DCC.Contacts:EmployeesList",
+    "DCC.Contacts",
+    "ListEmployees",
+    {
+        "Start": 0,
+        "Length": 100,
+        "OrderC": [1],
+        "OrderT": ["ASC"],
+        "Condition": "",
+        "Having": "",
+    },
+)
+
+SUMMARY_PAGE = (
+    "DCC::Alarms:ActiveCount",
+    "DCC::Alarms:GetActiveAlarmsEndpoints",
+    "DCC::Alarms:ActiveList",
+    "DCC::Logins:AvailableList",
+    "DCC::Checkins:ActiveList",
+)
+
+
+def bench_request_templates(count=20000):
+    # per call cost of building the url and body with the old f-string +
+    # json.dumps path vs the precompiled one, nothing is sent; the req/s one
+    # worker core sustains is measured by dcc_mock_server.py --bench
+    host, token, pid = "dcc.example.com", str(uuid4()), 12345
+    base = f"https://{host}"
+    urls = {n: r.url(base, token, pid) for n, r in DCCRequest.registry.items()}
+    print(f"{'template':<40} {'dumps builds/s':>15} {'template builds/s':>18}")
+    for name, req in DCCRequest.registry.items():
+        t0 = time.perf_counter()
+        for _ in range(count):
+            _ = req.url(base, token, pid), {"Host": host}
+            _ = json.dumps(req.fields).encode()
+        t1 = time.perf_counter()
+        for _ in range(count):
+            _ = urls[name], req.body
+        t2 = time.perf_counter()
+        print(f"{name:<40} {count / (t1 - t0):>15.0f} {count / (t2 - t1):>18.0f}")
+
+
+class DCCReplay:
+    """Compiles a HAR or JSON-lines capture of DCC client traffic into one
+    timeline file per session, a line per api.pts call:
+    [think_time, otype, method, with_pid, body]
+
+    The capture is streamed (a HAR needs ijson for that), sessions are told
+    apart by the token of the calls and the login calls are dropped,
+    replaying users run their own login.
+    """
+
+    max_open = 256
+
+    def __init__(self, out_dir: str):
+        self.out_dir = pathlib.Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.sessions: dict[str, tuple[str, float]] = {}  # token: (file, last time)
+        self.files: OrderedDict[str, object] = OrderedDict()
+        self.created: set[str] = set()
+
+    @staticmethod
+    def entries(capture: str):
+        if capture.endswith(".har"):
+            try:
+                import ijson  # pip install ijson
+            except ImportError:
+                # json.load of a multi-GB capture does not fit in memory
+                raise ImportError(
+                    f"{capture}: streaming a HAR needs ijson (pip install ijson),"
+                    " or convert the capture to JSON-lines"
+                ) from None
+        with open(capture, "rb") as f:
+            if capture.endswith(".har"):
+                yield from ijson.items(f, "log.entries.item")
+            else:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    @staticmethod
+    def parse_entry(entry: dict):
+        # HAR entry or {"time": ..., "url": ..., "body": ...}
+        request = entry.get("request", entry)
+        url = urlsplit(request.get("url", ""))
+        if not url.path.endswith("/api.pts"):
+            return None
+        started = entry.get("startedDateTime", entry.get("time"))
+        if isinstance(started, str):
+            started = datetime.fromisoformat(started).timestamp()
+        body = request.get("postData", {}).get("text", request.get("body")) or "{}"
+        return float(started), parse_qs(url.query), body
+
+    def write(self, token: str, line: str):
+        filename = self.sessions[token][0]
+        fh = self.files.pop(filename, None)
+        if fh is None:
+            fh = open(filename, "a" if filename in self.created else "w")
+            self.created.add(filename)
+            if len(self.files) >= self.max_open:
+                self.files.popitem(last=False)[1].close()
+        self.files[filename] = fh
+        fh.write(line)
+
+    def compile(self, capture: str):
+        calls = 0
+        for entry in self.entries(capture):
+            if not (parsed := self.parse_entry(entry)):
+                continue
+            started, query, body = parsed
+            otype = query.get("otype", [""])[0]
+            method = query.get("method", [""])[0]
+            token = query.get("token", [""])[0]
+            if otype.startswith("Admin.") or not token:
+                continue
+            if token not in self.sessions:
+                filename = self.out_dir / f"session_{len(self.sessions):05}.jsonl"
+                self.sessions[token] = (str(filename), started)
+            filename, last = self.sessions[token]
+            self.sessions[token] = (filename, started)
+            think = max(started - last, 0)
+            call = [think, otype, method, "pid" in query, body]
+            self.write(token, json.dumps(call) + "\n")
+            calls += 1
+        for fh in self.files.values():
+            fh.close()
+        self.files.clear()
+        print(f"{calls} calls of {len(self.sessions)} sessions in {self.out_dir}")
+
+    @staticmethod
+    def timeline(filename: str):
+        # loops over the session file, read line by line
+        while True:
+            with open(filename) as f:
+                for line in f:
+                    yield json.loads(line)
+
+
+class DCCSSLContext(gevent.ssl.SSLContext):
+    """Counts the TLS handshakes of the FastHttp connections as TLS requests
+    and, with resumption on, offers the last session of the host."""
+
+    environment = None
+    resumption = False
+    sessions: dict = {}
+    sockets: dict = {}
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        if self.resumption and session is None:
+            last = self.sockets.get(server_hostname)
+            # TLS 1.3 tickets arrive after the handshake, prefer the live socket
+            if last is not None and last.session is not None:
+                session = last.session
+            else:
+                session = self.sessions.get(server_hostname)
+        start = time.perf_counter()
+        exception = None
+        try:
+            ssl_sock = super().wrap_socket(
+                sock, *args, server_hostname=server_hostname, session=session, **kwargs
+            )
+        except Exception as e:
+            exception = e
+            raise
+        finally:
+            if self.environment:
+                reused = exception is None and ssl_sock.session_reused
+                self.environment.events.request.fire(
+                    request_type="TLS",
+                    name="resumed" if reused else "handshake",
+                    response_time=(time.perf_counter() - start) * 1000,
+                    response_length=0,
+                    exception=exception,
+                    context={},
+                )
+        if self.resumption:
+            self.sockets[server_hostname] = ssl_sock
+            self.sessions[server_hostname] = ssl_sock.session
+        return ssl_sock
+
+
+def dcc_ssl_context_factory():
+    # insecure like the Locust default, the DCC test servers use private CAs
+    context = DCCSSLContext(gevent.ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = gevent.ssl.CERT_NONE
+    return context
 
 
 class DCCUser(FastHttpUser, DCCWebSocket):
     host = "TEST"
+    api_scheme = "https"  # "http" for dcc_mock_server.py without TLS
     admin_api_host: str | None = None
     dcc_api_host: str | None = None
     dcc_instance_name: str | None = None
@@ -64,7 +840,42 @@ class DCCUser(FastHttpUser, DCCWebSocket):
     ws_todo: int = 0
     ws_sessions: int = 0
     summary_changed = True
+    ws_decode_events: list[str] = []  # EventTypes decoded and passed to ws_on_event
     summary_force = 10
+    summary_concurrent = False  # fire the summary page requests in parallel
+    summary_mode = "task"  # "event": refresh on websocket events, not as a task
+    summary_debounce: float = 0.5  # event mode, coalesce events in this window
+    summary_force_interval: float = 30.0  # event mode, refresh at least this often
+    summary_event: Event | None = None
+    summary_greenlet = None
+    all_tasks: list | None = None
+    task_tags: frozenset[str] = frozenset()  # @tag set of the running task
+    history_export = False  # enables the history-export task
+    history_page_size = 500
+    history_page_concurrency = 1
+    history_max_pages = 0  # 0 = all the pages up to Count
+    replay_dir: str | None = None  # compiled capture, replaces all the tasks
+    replay_speed: float = 1.0
+    hdr_log: str | None = None  # ex. "dcc_hdr.log.gz"
+    hdr_interval: float = 5.0
+    sample_file: str | None = None  # DCC process resources CSV, ex. "dcc_res.csv"
+    sample_interval: float = 1.0
+    pool_mode = "user"  # "user", "shared" per host by all users, "fresh" per request
+    pool_size = 10  # connections per user, or per host in shared mode
+    tls_resumption = False
+    ssl_context_factory = staticmethod(dcc_ssl_context_factory)
+    replay_files: itertools.cycle | None = None
+    replay = None
+    session_pool_size: int = 0  # 0 = every user runs its own login handshake
+    session_ttl: float = 3600.0
+    # one pool per login, [[users]] overrides may use other credentials
+    session_pools: dict[tuple, "DCCSessionPool"] = {}
+    session_pool: "DCCSessionPool | None" = None
+    session: "DCCSession | None" = None
+    urls_key: tuple | None = None
+    urls: dict[str, str]
+    dcc_headers: dict[str, str]
+    dcc_json_headers: dict[str, str]
     uuid: UUID
 
     default_headers = {
@@ -87,13 +898,52 @@ class DCCUser(FastHttpUser, DCCWebSocket):
 
     def on_start(self):
         self.uuid = uuid4()
-        if not self.admin_api_host:
-            get_toml_cfg(self)
+        DCCConfig.apply(self)
+        if self.session_pool_size > 0:
+            key = (
+                self.admin_api_host,
+                self.dcc_api_host,
+                self.dcc_user,
+                self.dcc_instance_guid,
+                self.dcc_instance_name,
+            )
+            self.session_pool = DCCUser.session_pools.get(key)
+            if self.session_pool is None:
+                self.session_pool = DCCSessionPool(
+                    self.session_pool_size, self.session_ttl
+                )
+                DCCUser.session_pools[key] = self.session_pool
+            self.session = self.session_pool.acquire(self)
+            if self.session:
+                self.summary_force_cntdown = self.summary_force
+        else:
+            self.dcc_login()
+        if self.summary_mode == "event":
+            self.summary_event = Event()
+            self.summary_greenlet = gevent.spawn(self.summary_scheduler)
+
+    def on_stop(self):
+        if self.summary_greenlet:
+            self.summary_greenlet.kill(block=False)
+            self.summary_greenlet = None
+        if self.ws:
+            # unregisters the socket from the shared engine
+            self.ws.close()
+            self.ws = None
+        if self.session:
+            session, self.session = self.session, None
+            if not self.session_pool.release(session, self):
+                self.pid = None
+                self.dcc_token = None
+                return
+        self.dcc_logout()
+
+    def dcc_login(self) -> bool:
         if self.admin_api_host:
             logging.debug(f"{self.uuid} REQ PoltysConnect {self.admin_api_host}")
             with self.rest(
                 "POST",
-                f"https://{self.admin_api_host}/api.pts?otype=Admin.Users&method=PoltysConnect&token=null",
+                f"{self.api_scheme}://{self.admin_api_host}/api.pts?otype=Admin.Users&method=PoltysConnect&token=null",
                 headers={
                     "Host": self.admin_api_host,
                 },
@@ -128,7 +978,7 @@ class DCCUser(FastHttpUser, DCCWebSocket):
             )
             with self.rest(
                 "POST",
-                f"https://{self.admin_api_host}/api.pts?otype=Admin.MainServer&method=ChooseLicense&token={self.admin_token_global}",
+                f"{self.api_scheme}://{self.admin_api_host}/api.pts?otype=Admin.MainServer&method=ChooseLicense&token={self.admin_token_global}",
                 headers={
                     "Host": self.admin_api_host,
                 },
@@ -146,7 +996,7 @@ class DCCUser(FastHttpUser, DCCWebSocket):
             logging.debug(f"{self.uuid} REQ pid")
             with self.rest(
                 "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=Utils.Miscellaneous&method=GetProcessInfo&token={self.dcc_token}",
+                f"{self.api_scheme}://{self.dcc_api_host}/api.pts?otype=Utils.Miscellaneous&method=GetProcessInfo&token={self.dcc_token}",
                 headers={
                     "Host": self.dcc_api_host,
                 },
@@ -155,23 +1005,26 @@ class DCCUser(FastHttpUser, DCCWebSocket):
             ) as resp:
                 if resp.status_code == 200:
                     self.pid = int(resp.json().get("PID"))
+                    DCCSampler.pid = self.pid
                     if self.pid:
                         self.summary_force_cntdown = self.summary_force
                         logging.info(f"{self.uuid} User Login Successfull")
+        return bool(self.pid)
 
-    def on_stop(self):
-        if self.dcc_token:
+    def dcc_logout(self, token_global: str | None = None):
+        """Disconnect the login of this user, or the older one of token_global"""
+        if token_global or self.dcc_token:
             logging.debug(f"{self.uuid} REQ Disconnect")
             with self.rest(
                 "POST",
-                f"https://{self.admin_api_host}/api.pts?otype=Admin.Users&method=Disconnect&token={self.admin_token_global}",
+                f"{self.api_scheme}://{self.admin_api_host}/api.pts?otype=Admin.Users&method=Disconnect&token={token_global or self.admin_token_global}",
                 headers={
                     "Host": self.admin_api_host,
                 },
                 json={"Password": None},
                 name="Admin.Users:Disconnect",
             ) as resp:
-                if resp.status_code == 200:
+                if resp.status_code == 200 and not token_global:
                     self.pid = None
                     self.dcc_token = None
                     logging.info(
@@ -239,15 +1092,7 @@ class DCCUser(FastHttpUser, DCCWebSocket):
     @tag("processinfo")
     @task(100)
     def dcc_proccess_info(self):
-        with self.rest(
-            "POST",
-            f"https://{self.dcc_api_host}/api.pts?otype=Utils.Miscellaneous&method=GetProcessInfo&token={self.dcc_token}",
-            headers={
-                "Host": self.dcc_api_host,
-            },
-            json={},
-            name="SingleProcessInfo",
-        ) as _:
+        with self.dcc_request("SingleProcessInfo") as _:
             pass
 
     @tag("websocket")
@@ -258,7 +1103,8 @@ class DCCUser(FastHttpUser, DCCWebSocket):
                 self.ws_todo = self.ws_todo_wait
                 self.ws_sessions += 1
                 logging.info(f"{self.uuid} New websocket connection")
-                self.ws_connect(f"wss://{self.dcc_api_host}/api.ws")
+                ws_scheme = "wss" if self.api_scheme == "https" else "ws"
+                self.ws_connect(f"{ws_scheme}://{self.dcc_api_host}/api.ws")
 
                 self.ws_send(
                     '{"Type":"ConnectBulk","ConnectionsInfo":'
@@ -270,279 +1116,723 @@ class DCCUser(FastHttpUser, DCCWebSocket):
                 )
 
                 # update pid, execute this to count the websocket connection count
-                with self.rest(
-                    "POST",
-                    f"https://{self.dcc_api_host}/api.pts?otype=Utils.Miscellaneous&method=GetProcessInfo&token={self.dcc_token}",
-                    headers={
-                        "Host": self.dcc_api_host,
-                    },
-                    json={},
-                    name="WebSocket:Connect",
-                ) as resp:
+                with self.dcc_request("WebSocket:Connect") as resp:
                     if resp.status_code == 200:
                         self.pid = int(resp.json().get("PID"))
+                        DCCSampler.pid = self.pid
 
             elif self.ws_todo == 1:
-                try:
+                if self.ws:
                     self.ws.close()
-                except:
-                    pass
                 logging.info(f"{self.uuid} End websocket connection")
                 self.ws_todo = 0
             else:
                 self.ws_todo -= 1
 
-    def ws_on_message(self, message):
-        obj = json.loads(message)
-        if obj and not obj.get("KeepAlive") and not obj.get("Response"):
-            # print(message)
+    def ws_on_message(self, message) -> str:
+        kind = ws_frame_kind(message)
+        if kind != "KeepAlive" and kind != "Response":
             self.summary_changed = True
-        pass
+            if self.summary_event:
+                self.summary_event.set()
+            if kind in self.ws_decode_events:
+                self.ws_on_event(kind, ws_loads(message))
+        return kind
+
+    def ws_on_event(self, kind: str, obj: dict):
+        logging.debug(f"{self.uuid} WS event {kind} {obj}")
 
     @tag("devices")
     @task(20)
     def dcc_devices(self):
         if self.dcc_token and self.pid:
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=Devices.Endpoints&method=Count&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={
-                    "Condition": "({1} LIKE '%11%' OR {2} LIKE '%11%' OR {13} LIKE '%11%' OR {3} LIKE '%11%' OR {4} LIKE '%11%' OR {5} LIKE '%11%' OR {6} LIKE '%11%' OR {9} LIKE '%11%' OR {10} LIKE '%11%')",
-                    "Line": "Sim Residents",
-                },
-                name="Devices.Endpoints:Count",
-            ) as _:
+            with self.dcc_request("Devices.Endpoints:Count") as _:
                 pass
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=Devices.Endpoints&method=List&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={
-                    "Start": 0,
-                    "Length": 20,
-                    "OrderC": [6, 2],
-                    "OrderT": ["ASC", "ASC"],
-                    "Condition": "({1} LIKE '%11%' OR {2} LIKE '%11%' OR {13} LIKE '%11%' OR {3} LIKE '%11%' OR {4} LIKE '%11%' OR {5} LIKE '%11%' OR {6} LIKE '%11%' OR {9} LIKE '%11%' OR {10} LIKE '%11%') AND  EndpointTypes.Name != 'LineMaintenance'  AND Lines_.Name = 'Sim Residents'",
-                    "Having": "",
-                },
-                name="Devices.Endpoints:List",
-            ) as _:
+            with self.dcc_request("Devices.Endpoints:List") as _:
                 pass
 
     @tag("summary")
     @task(500)
     def dcc_summary(self):
-        if self.dcc_token and self.pid:
+        if self.dcc_token and self.pid and self.summary_mode == "task":
             if not self.summary_changed:
                 self.summary_force_cntdown -= 1
                 if self.summary_force_cntdown > 0:
                     return
                 else:
                     self.summary_force_cntdown = self.summary_force
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=DCC::Alarms&method=ActiveCount&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={
-                    "Condition": "",
-                    "Having": "(JSON_SEARCH({15}, 'one', '%') IS NULL OR JSON_CONTAINS({15}, '[\"BUILDING\"]') OR JSON_CONTAINS({15}, '[\"Special\"]')) AND (JSON_SEARCH({16}, 'one', '%') IS NULL OR JSON_CONTAINS({16}, '[\"Caregiver\"]'))",
-                    "Version": 1,
-                },
-                name="DCC::Alarms:ActiveCount",
-            ) as _:
-                pass
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=DCC::Alarms&method=GetActiveAlarmsEndpoints&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={},
-                name="DCC::Alarms:GetActiveAlarmsEndpoints",
-            ) as _:
-                pass
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=DCC::Alarms&method=ActiveList&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={
-                    "Version": 1,
-                    "Start": 0,
-                    "Length": 300,
-                    "OrderC": [],
-                    "OrderT": [],
-                    "Condition": "",
-                    "Having": "(JSON_SEARCH({15}, 'one', '%') IS NULL OR JSON_CONTAINS({15}, '[\"BUILDING\"]') OR JSON_CONTAINS({15}, '[\"Special\"]')) AND (JSON_SEARCH({16}, 'one', '%') IS NULL OR JSON_CONTAINS({16}, '[\"Caregiver\"]'))",
-                },
-                name="DCC::Alarms:ActiveList",
-            ) as resp:
-                pass
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=DCC::Logins&method=AvailableList&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={
-                    "Locations": ["<empty>", "BUILDING", "Special"],
-                    "Competences": ["<empty>", "Caregiver"],
-                    "Shift": "Day",
-                },
-                name="DCC::Logins:AvailableList",
-            ) as _:
-                pass
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=DCC::Checkins&method=ActiveList&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={
-                    "Start": 0,
-                    "Length": 300,
-                    "OrderC": [1],
-                    "OrderT": ["ASC"],
-                    "Condition": "",
-                    "Having": "(JSON_SEARCH({6}, 'one', '%') IS NULL OR JSON_CONTAINS({6}, '[\"BUILDING\"]') OR JSON_CONTAINS({6}, '[\"Special\"]'))",
-                },
-                name="DCC::Checkins:ActiveList",
-            ) as _:
-                pass
+            self.dcc_summary_page()
             self.summary_changed = False
 
-    def __dcc_history(
-        self,
-        *,
-        name="",
-        condition=None,
-        having=None,
-        from_archive=False,
-    ):
+    def summary_scheduler(self):
+        # like the browser: refresh on events, a burst of events gives one
+        # refresh after summary_debounce, without events every force interval
+        while True:
+            if self.dcc_token and self.pid:
+                self.summary_changed = False
+                # runs besides the tasks, tag it like the summary task
+                self.dcc_summary_page({"tags": DCCUser.dcc_summary.locust_tag_set})
+            self.summary_event.wait(self.summary_force_interval)
+            if self.summary_event.is_set():
+                gevent.sleep(self.summary_debounce)
+            self.summary_event.clear()
+
+    def context(self) -> dict:
+        # merged by the client into every request event, read by DCCHdr
+        return {"tags": self.task_tags}
+
+    @staticmethod
+    def tagged(task):
+        @functools.wraps(task)
+        def run(user):
+            user.task_tags = getattr(task, "locust_tag_set", frozenset())
+            try:
+                task(user)
+            finally:
+                user.task_tags = frozenset()
+
+        return run
+
+    @classmethod
+    def select_tasks(cls, tags: list[str] | None = None):
+        if cls.all_tasks is None:
+            cls.all_tasks = list(cls.tasks)  # after the --tags filtering
+        tasks = cls.all_tasks
+        if tags:
+            tags = set(tags)
+            tasks = [t for t in tasks if getattr(t, "locust_tag_set", set()) & tags]
+        if cls.summary_mode == "event":
+            tasks = [t for t in tasks if t is not DCCUser.dcc_summary]
+        if not cls.history_export:
+            tasks = [t for t in tasks if t is not DCCUser.dcc_history_export]
+        if cls.replay_dir:
+            tasks = [DCCUser.dcc_replay]
+        else:
+            tasks = [t for t in tasks if t is not DCCUser.dcc_replay]
+        if tasks:
+            # one wrapper per task, the weights repeat them in the list
+            wrapped = {t: cls.tagged(t) for t in tasks}
+            cls.tasks = [wrapped[t] for t in tasks]
+        else:
+            logging.warning(f"No {cls.__name__} task left for tags {tags}")
+
+    @classmethod
+    def configure_pool(cls, environment):
+        DCCSSLContext.environment = environment
+        DCCSSLContext.resumption = cls.tls_resumption
+        cls.concurrency = cls.pool_size
+        match cls.pool_mode:
+            case "shared":
+                cls.client_pool = HTTPClientPool(
+                    concurrency=cls.pool_size,
+                    ssl_context_factory=cls.ssl_context_factory,
+                    insecure=cls.insecure,
+                    network_timeout=cls.network_timeout,
+                    connection_timeout=cls.connection_timeout,
+                )
+            case "fresh":
+                cls.default_headers = cls.default_headers | {"Connection": "close"}
+            case "user":
+                pass
+            case _:
+                logging.warning(f"Unknown pool_mode {cls.pool_mode}, using user")
+
+    def dcc_summary_page(self, context: dict | None = None):
+        # the browser loads the summary page with all requests in parallel,
+        # record the whole page as one sample besides the single requests
+        context = context or self.context()
+        start = time.perf_counter()
+        if self.summary_concurrent:
+            greenlets = [
+                gevent.spawn(self.dcc_summary_request, name, context)
+                for name in SUMMARY_PAGE
+            ]
+            gevent.joinall(greenlets)
+            results = [g.value if g.successful() else None for g in greenlets]
+        else:
+            results = [self.dcc_summary_request(name, context) for name in SUMMARY_PAGE]
+        failed = [name for name, res in zip(SUMMARY_PAGE, results) if res is None]
+        self.environment.events.request.fire(
+            request_type="PAGE",
+            name="Summary page",
+            response_time=(time.perf_counter() - start) * 1000,
+            response_length=sum(res for res in results if res),
+            exception=Exception(f"failed {', '.join(failed)}") if failed else None,
+            context=context,
+        )
+
+    def dcc_summary_request(self, name: str, context: dict) -> int | None:
+        with self.dcc_request(name, context=context) as resp:
+            if resp.status_code == 200:
+                return len(resp.content or b"")
+        return None
+
+    def __dcc_history(self, *, name=""):
         if self.dcc_token and self.pid:
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=DCC::Alarms&method=Count&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={
-                    "Condition": condition,
-                    "Having": having,
-                    "FromArchive": from_archive,
-                },
-                name="DCC::Alarms:Count"+name,
-            ) as _:
+            with self.dcc_request("DCC::Alarms:Count" + name) as _:
                 pass
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=DCC::Alarms&method=List&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={
-                    "Start": 0,
-                    "Length": 100,
-                    "OrderC": [1],
-                    "OrderT": ["DESC"],
-                    "Condition": condition,
-                    "Having": having,
-                    "FromArchive": from_archive,
-                },
-                name="DCC::Alarms:List"+name,
-            ) as _:
+            with self.dcc_request("DCC::Alarms:List" + name) as _:
                 pass
 
     @tag("history")
     @task(20)
     def dcc_history_24h(self):
-        self.__dcc_history(
-            name=" - 24H",
-            condition="({1} > DATE_SUB(@currTimeUTC, INTERVAL 24 HOUR))",
-            having="(JSON_SEARCH({20}, 'one', '%') IS NULL OR JSON_CONTAINS({20}, '[\"BUILDING\"]')) AND (JSON_SEARCH({21}, 'one', '%') IS NULL OR JSON_CONTAINS({21}, '[\"Caregiver\"]'))",
-        )
+        self.__dcc_history(name=" - 24H")
 
     @tag("history-huge")
     @task
     def dcc_history_huge(self):
-        self.__dcc_history(
-            name=" - 1MON",
-            condition="({1} > DATE_SUB(@currTimeUTC, INTERVAL 1 MONTH))",
-            having=None,
+        self.__dcc_history(name=" - 1MON")
+
+    @tag("history-export")
+    @task
+    def dcc_history_export(self):
+        # walk all the pages of the 1 month history like a supervisor export
+        if not (self.dcc_token and self.pid):
+            return
+        name = "DCC::Alarms:List - 1MON"
+        with self.dcc_request("DCC::Alarms:Count - 1MON") as resp:
+            count = resp.js.get("Count") if isinstance(resp.js, dict) else resp.js
+        if not isinstance(count, int) or count <= 0:
+            return
+        starts = range(0, count, self.history_page_size)
+        if self.history_max_pages:
+            starts = starts[: self.history_max_pages]
+        pool = gevent.pool.Pool(self.history_page_concurrency)
+        for start in starts:
+            pool.spawn(self.dcc_page, name, start)
+        pool.join()
+
+    @tag("replay")
+    @task
+    def dcc_replay(self):
+        if not (self.dcc_token and self.pid):
+            return
+        if self.replay is None:
+            if DCCUser.replay_files is None:
+                files = sorted(pathlib.Path(self.replay_dir).glob("session_*.jsonl"))
+                DCCUser.replay_files = itertools.cycle(files)
+            self.replay = DCCReplay.timeline(next(self.replay_files))
+        think, otype, method, with_pid, body = next(self.replay)
+        gevent.sleep(think / self.replay_speed)
+        if self.urls_key != (self.dcc_api_host, self.dcc_token, self.pid):
+            self.compile_requests()
+        url = (
+            f"{self.api_scheme}://{self.dcc_api_host}/api.pts"
+            f"?otype={otype}&method={method}&token={self.dcc_token}"
+        )
+        if with_pid:
+            url += f"&pid={self.pid}"
+        with self.rest(
+            "POST",
+            url,
+            headers=self.dcc_headers,
+            data=body.encode(),
+            name=f"{otype}:{method}",
+        ) as _:
+            pass
+
+    def dcc_page(self, name: str, start: int):
+        # stream the page body and count it, never hold the whole payload
+        body = DCCRequest.registry[name].page(start, self.history_page_size)
+        start_time = time.perf_counter()
+        first_byte = None
+        length = 0
+        exception = None
+        resp = self.client.request(
+            "POST",
+            self.dcc_url(name),
+            headers=self.dcc_json_headers,
+            data=body,
+            name=name + " page",
+            stream=True,
+        )
+        try:
+            if resp.status_code != 200:
+                # error pages are not pages, and connection errors have no stream
+                raise getattr(resp, "error", None) or Exception(
+                    f"HTTP {resp.status_code}"
+                )
+            while chunk := resp.stream.read(65536):
+                if first_byte is None:
+                    first_byte = time.perf_counter()
+                length += len(chunk)
+        except Exception as e:
+            exception = e
+        finally:
+            # back to the user's connection pool, or closed when not reusable;
+            # status 0 is locust's ErrorResponse, without a connection
+            if resp.status_code:
+                resp.release()
+        end_time = time.perf_counter()
+        if first_byte is not None and exception is None:
+            self.environment.events.request.fire(
+                request_type="TTFB",
+                name=name + " page",
+                response_time=(first_byte - start_time) * 1000,
+                response_length=0,
+                exception=None,
+                context=self.context(),
+            )
+        self.environment.events.request.fire(
+            request_type="PAGE",
+            name=name + " page",
+            response_time=(end_time - start_time) * 1000,
+            response_length=length,
+            exception=exception,
+            context=self.context(),
         )
 
     @tag("residents")
     @task(10)
     def dcc_residents(self):
         if self.dcc_token and self.pid:
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=DCC.Contacts&method=CountResidents&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={"Condition": "", "Having": ""},
-                name="DCC.Contacts:ResidentsCount",
-            ) as _:
+            with self.dcc_request("DCC.Contacts:ResidentsCount") as _:
                 pass
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=DCC.Contacts&method=ListResidents&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={
-                    "Start": 0,
-                    "Length": 100,
-                    "OrderC": [1],
-                    "OrderT": ["ASC"],
-                    "Condition": "",
-                    "Having": "",
-                },
-                name="DCC.Contacts:ResidentsList",
-            ) as _:
+            with self.dcc_request("DCC.Contacts:ResidentsList") as _:
                 pass
 
     @tag("employees")
     @task(10)
     def dcc_employees(self):
         if self.dcc_token and self.pid:
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=DCC.Contacts&method=ListEmployees&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={"Condition": "", "Having": ""},
-                name="DCC.Contacts:EmployeesCount",
-            ) as _:
+            with self.dcc_request("DCC.Contacts:EmployeesCount") as _:
                 pass
-            with self.rest(
-                "POST",
-                f"https://{self.dcc_api_host}/api.pts?otype=DCC.Contacts&method=ListEmployees&token={self.dcc_token}&pid={self.pid}",
-                headers={
-                    "Host": self.dcc_api_host,
-                },
-                json={
-                    "Start": 0,
-                    "Length": 100,
-                    "OrderC": [1],
-                    "OrderT": ["ASC"],
-                    "Condition": "",
-                    "Having": "",
-                },
-                name="DCC.Contacts:EmployeesList",
-            ) as _:
+            with self.dcc_request("DCC.Contacts:EmployeesList") as _:
                 pass
 
+    def compile_requests(self):
+        self.urls_key = (self.dcc_api_host, self.dcc_token, self.pid)
+        self.dcc_headers = {"Host": self.dcc_api_host}
+        self.dcc_json_headers = {
+            "Host": self.dcc_api_host,
+            "Content-Type": "application/json",
+        }
+        base = f"{self.api_scheme}://{self.dcc_api_host}"
+        self.urls = {
+            name: req.url(base, self.dcc_token, self.pid)
+            for name, req in DCCRequest.registry.items()
+        }
+
+    def dcc_url(self, name: str) -> str:
+        if self.urls_key != (self.dcc_api_host, self.dcc_token, self.pid):
+            self.compile_requests()
+        return self.urls[name]
+
+    def dcc_request(self, name: str, body: bytes | None = None, **kwargs):
+        return self.rest(
+            "POST",
+            self.dcc_url(name),
+            headers=self.dcc_headers,
+            data=DCCRequest.registry[name].body if body is None else body,
+            name=name,
+            **kwargs,
+        )
+
+
+class LogHistogram:
+    """HDR style latency histogram: 2**SUB_BITS linear buckets per power of
+    two of microseconds, relative error below 2**(1 - SUB_BITS).
+    Histograms merge by adding their sparse bucket counts."""
+
+    SUB_BITS = 8
+
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def index(cls, value: int) -> int:
+        if value < 1 << cls.SUB_BITS:
+            return value
+        e = value.bit_length() - cls.SUB_BITS
+        return (e << (cls.SUB_BITS - 1)) + (value >> e)
+
+    @classmethod
+    def value(cls, index: int) -> int:
+        # middle of the bucket
+        if index < 1 << cls.SUB_BITS:
+            return index
+        e = (index >> (cls.SUB_BITS - 1)) - 1
+        return ((index - (e << (cls.SUB_BITS - 1))) << e) + (1 << e >> 1)
+
+    def record(self, response_time_ms: float):
+        value = int(response_time_ms * 1000)
+        i = self.index(value)
+        self.counts[i] = self.counts.get(i, 0) + 1
+        self.total += 1
+        if value > self.max:
+            self.max = value
+
+    def merge(self, encoded: list[int]):
+        # encoded: [max, index, count, index, count, ...]
+        self.max = max(self.max, encoded[0])
+        for i in range(1, len(encoded), 2):
+            index, count = encoded[i], encoded[i + 1]
+            self.counts[index] = self.counts.get(index, 0) + count
+            self.total += count
+
+    def encode(self) -> list[int]:
+        encoded = [self.max]
+        for item in self.counts.items():
+            encoded += item
+        return encoded
+
+    def percentile(self, p: float) -> float:
+        """response time in ms"""
+        rank = p * self.total
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.value(index), self.max) / 1000
+        return self.max / 1000
+
+
+class DCCHdr:
+    """Per request type and name, and per task tag and request type,
+    histograms of the response times.
+
+    Workers send their interval histograms with the report to the master,
+    the master (or the local runner) merges them and appends every
+    interval to a gzip log in the HdrHistogram interval log layout, the
+    histogram payload being base64(zlib(json([max, index, count, ...]))).
+    """
+
+    interval: dict[str, LogHistogram] = {}
+    total: dict[str, LogHistogram] = {}
+    log = None
+    start = 0.0
+
+    @classmethod
+    def on_request(
+        cls, request_type, name, response_time, exception, context=None, **_kwargs
+    ):
+        if exception or request_type == "WSR":
+            return
+        if request_type == "WS":
+            name = f"WebSocket {name}"
+        # one name can carry several measures (the pages POST, TTFB and PAGE)
+        keys = [f"{request_type} {name}"]
+        for tag in sorted((context or {}).get("tags", ())):
+            keys.append(f"tag:{tag} {request_type}")
+        for key in keys:
+            if key not in cls.interval:
+                cls.interval[key] = LogHistogram()
+            cls.interval[key].record(response_time)
+
+    @classmethod
+    def on_report_to_master(cls, data, **_kwargs):
+        data["dcc_hdr"] = {k: h.encode() for k, h in cls.interval.items()}
+        cls.interval = {}
+
+    @classmethod
+    def on_worker_report(cls, data, **_kwargs):
+        for key, encoded in data.get("dcc_hdr", {}).items():
+            if key not in cls.interval:
+                cls.interval[key] = LogHistogram()
+            cls.interval[key].merge(encoded)
+
+    @classmethod
+    def open(cls, filename: str):
+        cls.start = time.time()
+        cls.log = gzip.open(filename, "at")
+        cls.log.write(f"#[StartTime: {cls.start:.3f} (seconds since epoch)]\n")
+        cls.log.write(
+            '"StartTimestamp","Interval_Length","Interval_Max",'
+            '"Interval_Compressed_Histogram"\n'
+        )
+
+    @classmethod
+    def write_loop(cls, interval: float):
+        while True:
+            gevent.sleep(interval)
+            cls.write(interval)
+
+    @classmethod
+    def write(cls, interval: float):
+        histograms, cls.interval = cls.interval, {}
+        start = time.time() - cls.start - interval
+        for key, h in histograms.items():
+            payload = base64.b64encode(zlib.compress(json.dumps(h.encode()).encode()))
+            cls.log.write(
+                f"Tag={key},{start:.3f},{interval:.3f},{h.max / 1000:.3f},"
+                f"{payload.decode()}\n"
+            )
+            if key not in cls.total:
+                cls.total[key] = LogHistogram()
+            cls.total[key].merge(h.encode())
+        cls.log.flush()
+
+    @classmethod
+    def on_quitting(cls, **_kwargs):
+        if cls.log:
+            cls.write(0)
+            cls.log.close()
+            cls.log = None
+        print(f"{'name':<45} {'count':>8} {'p50':>9} {'p99':>9} {'p99.9':>9} {'max':>9}")
+        for key, h in sorted(cls.total.items()):
+            p50, p99, p999 = (h.percentile(p) for p in (0.5, 0.99, 0.999))
+            print(
+                f"{key:<45} {h.total:>8} {p50:>9.1f} {p99:>9.1f} {p999:>9.1f}"
+                f" {h.max / 1000:>9.1f}"
+            )
+
+
+class DCCSampler:
+    """Samples the DCC server process (PID from GetProcessInfo) with psutil
+    next to the Locust throughput and latency, one CSV row per interval.
+    Only meaningful when the DCC server (or dcc_mock_server.py) runs on the
+    same host as the master / local runner."""
+
+    pid: int | None = None
+    # the WSR/WS/PAGE/TTFB/TLS entries are not requests served by the DCC
+    HTTP_METHODS = frozenset(("GET", "POST", "PUT", "DELETE", "PATCH", "HEAD"))
+
+    def __init__(self, environment, filename: str, interval: float):
+        self.environment = environment
+        self.filename = filename
+        self.interval = interval
+        self.process = None
+
+    @classmethod
+    def on_report_to_master(cls, data, **_kwargs):
+        data["dcc_pid"] = cls.pid
+
+    @classmethod
+    def on_worker_report(cls, data, **_kwargs):
+        if data.get("dcc_pid"):
+            cls.pid = data["dcc_pid"]
+
+    def run(self):
+        import psutil
+
+        with open(self.filename, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                [
+                    "Timestamp",
+                    "User Count",
+                    "Requests/s",
+                    "Failures/s",
+                    "50%",
+                    "95%",
+                    "PID",
+                    "CPU %",
+                    "RSS MB",
+                    "Threads",
+                    "Sockets",
+                    "CPU ms/request",
+                ]
+            )
+            while True:
+                gevent.sleep(self.interval)
+                writer.writerow(self.sample(psutil))
+                f.flush()
+
+    @staticmethod
+    def current_percentiles(entries, percents) -> list:
+        """Percentiles of the last ~10s of all entries merged, as locust computes
+        them for a single entry in get_current_response_time_percentile"""
+        t = int(time.time()) - CURRENT_RESPONSE_TIME_PERCENTILE_WINDOW
+        candidates = sorted(range(t - 8, t + 9), key=lambda ts: abs(ts - t))
+        window = Counter()
+        count = 0
+        for entry in entries:
+            cache = entry.response_times_cache or {}
+            cached = next((cache[ts] for ts in candidates if ts in cache), None)
+            if cached is None:
+                continue
+            window.update(
+                diff_response_time_dicts(entry.response_times, cached.response_times)
+            )
+            count += entry.num_requests - cached.num_requests
+            count -= entry.num_none_requests - cached.num_none_requests
+        if not count:
+            return [None] * len(percents)
+        return [calculate_response_time_percentile(window, count, p) for p in percents]
+
+    def sample(self, psutil) -> list:
+        entries = self.environment.runner.stats.entries
+        http = [e for (_, method), e in entries.items() if method in self.HTTP_METHODS]
+        rps = sum(e.current_rps for e in http)
+        p50, p95 = self.current_percentiles(http, (0.5, 0.95))
+        row = [
+            int(time.time()),
+            self.environment.runner.user_count,
+            round(rps, 2),
+            round(sum(e.current_fail_per_sec for e in http), 2),
+            p50,
+            p95,
+        ]
+        if self.pid and (self.process is None or self.process.pid != self.pid):
+            try:
+                self.process = psutil.Process(self.pid)
+                self.process.cpu_percent(None)  # first call is meaningless
+            except psutil.Error as e:
+                logging.warning(f"Cannot sample DCC process {self.pid}: {e!r}")
+                self.process = None
+                DCCSampler.pid = None
+        if self.process is None:
+            return row + [self.pid, None, None, None, None, None]
+        try:
+            with self.process.oneshot():
+                cpu = self.process.cpu_percent(None)
+                rss = self.process.memory_info().rss / 1048576
+                threads = self.process.num_threads()
+                if hasattr(self.process, "net_connections"):
+                    sockets = len(self.process.net_connections())
+                else:
+                    sockets = len(self.process.connections())
+        except psutil.Error as e:
+            logging.warning(f"DCC process {self.pid} sample error {e!r}")
+            self.process = None
+            return row + [self.pid, None, None, None, None, None]
+        # cpu % of one core -> cpu ms per second
+        cost = round(cpu * 10 / rps, 3) if rps else None
+        return row + [self.pid, cpu, round(rss, 1), threads, sockets, cost]
+
+
+class DCCLoadShape(LoadTestShape):
+    """Ramp stages from the [shape] section of locustcfg.toml
+
+    [shape]
+    on_breach = "step_back"  # or "stop"
+    hold = 300  # seconds to hold the last good stage after a step back
+    slo_grace = 30  # seconds after a stage start before checking its SLOs
+
+    [[shape.stages]]
+    users = 500
+    spawn_rate = 20
+    duration = 600
+    tags = ["summary", "websocket"]  # optional task tags for this stage
+    slo = { "DCC::Alarms:ActiveList" = 800, "connect" = 2000 }  # p95 ms
+
+    The shape is used only when stages are configured. In distributed mode
+    it runs on the master and sends the stage tags to the workers.
+    """
+
+    abstract = True
+
+    def __init__(self):
+        super().__init__()
+        cfg = DCCConfig.section("shape")
+        self.stages = cfg.get("stages", [])
+        self.on_breach = cfg.get("on_breach", "stop")
+        self.hold = cfg.get("hold", 300)
+        self.slo_grace = cfg.get("slo_grace", 30)
+        self.stage = -1
+        self.stage_start = 0.0
+        self.hold_until: float | None = None
+
+    def tick(self):
+        run_time = self.get_run_time()
+        if self.hold_until is not None:
+            if run_time < self.hold_until:
+                stage = self.stages[self.stage]
+                return stage["users"], stage["spawn_rate"]
+            return None
+        end = 0
+        for i, stage in enumerate(self.stages):
+            end += stage["duration"]
+            if run_time < end:
+                break
+        else:
+            return None
+        if i != self.stage:
+            self.start_stage(i, run_time)
+        if run_time - self.stage_start > self.slo_grace and (
+            breach := self.slo_breach(stage)
+        ):
+            logging.warning(f"Stage {i} users {stage['users']} SLO breach: {breach}")
+            if self.on_breach == "step_back" and i > 0:
+                low, high = self.stages[i - 1]["users"], stage["users"]
+                logging.warning(f"Capacity knee between {low} and {high} users")
+                self.start_stage(i - 1, run_time)
+                self.hold_until = run_time + self.hold
+                return self.tick()
+            return None
+        return stage["users"], stage["spawn_rate"]
+
+    def start_stage(self, i: int, run_time: float):
+        self.stage = i
+        self.stage_start = run_time
+        tags = self.stages[i].get("tags")
+        logging.info(f"Stage {i}: {self.stages[i]}")
+        if isinstance(self.runner, MasterRunner):
+            self.runner.send_message("dcc_tags", tags)
+        else:
+            DCCUser.select_tasks(tags)
+
+    def slo_breach(self, stage) -> str | None:
+        for name, limit in stage.get("slo", {}).items():
+            for (entry_name, _), entry in self.runner.stats.entries.items():
+                if entry_name != name or not entry.num_requests:
+                    continue
+                try:
+                    p95 = entry.get_current_response_time_percentile(0.95)
+                except ValueError:
+                    p95 = entry.get_response_time_percentile(0.95)
+                if p95 and p95 > limit:
+                    return f"{name} p95 {p95}ms > {limit}ms"
+        return None
+
+
+DCCLoadShape.abstract = not DCCConfig.section("shape").get("stages")
+
+
+def on_dcc_tags(environment, msg, **_kwargs):
+    DCCUser.select_tasks(msg.data)
+
+
+@events.init.add_listener
+def on_locust_init(environment, **_kwargs):
+    # workers start the credentials round-robin at different offsets
+    worker_index = getattr(environment.runner, "worker_index", 0) or 0
+    DCCConfig.apply_class(DCCUser, offset=worker_index)
+    DCCUser.select_tasks()
+    DCCUser.configure_pool(environment)
+    if isinstance(environment.runner, WorkerRunner):
+        environment.runner.register_message("dcc_tags", on_dcc_tags)
+    elif not DCCLoadShape.abstract:
+        # current percentiles for the stage SLOs
+        environment.stats.use_response_times_cache = True
+    if DCCUser.hdr_log:
+        environment.events.request.add_listener(DCCHdr.on_request)
+        if isinstance(environment.runner, WorkerRunner):
+            environment.events.report_to_master.add_listener(
+                DCCHdr.on_report_to_master
+            )
+        else:
+            if isinstance(environment.runner, MasterRunner):
+                environment.events.worker_report.add_listener(DCCHdr.on_worker_report)
+            DCCHdr.open(DCCUser.hdr_log)
+            gevent.spawn(DCCHdr.write_loop, DCCUser.hdr_interval)
+            environment.events.quitting.add_listener(DCCHdr.on_quitting)
+    if DCCUser.sample_file and environment.runner:
+        if isinstance(environment.runner, WorkerRunner):
+            environment.events.report_to_master.add_listener(
+                DCCSampler.on_report_to_master
+            )
+        else:
+            if isinstance(environment.runner, MasterRunner):
+                environment.events.worker_report.add_listener(
+                    DCCSampler.on_worker_report
+                )
+            environment.stats.use_response_times_cache = True
+            sampler = DCCSampler(
+                environment, DCCUser.sample_file, DCCUser.sample_interval
+            )
+            gevent.spawn(sampler.run)
+
 
 if __name__ == "__main__":
-    run_single_user(DCCUser)
+    if "--bench-templates" in sys.argv:
+        bench_request_templates()
+    elif "--compile-replay" in sys.argv:
+        # --compile-replay capture.har|capture.jsonl out_dir
+        i = sys.argv.index("--compile-replay")
+        DCCReplay(sys.argv[i + 2]).compile(sys.argv[i + 1])
+    else:
+        run_single_user(DCCUser)
@@ -1,90 +1,1839 @@
 #!/usr/bin/env python3.12
-from datetime import date, datetime
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timezone
+import glob
+import gzip
+import heapq
+import itertools
+import json
 import logging
+import mmap
+import os
 import pathlib
-from signal import SIGINT
+import queue
+from signal import SIGINT, SIGTERM, Signals, default_int_handler, signal
 import subprocess
 import re
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import shutil
+import socket
+import struct
 import sys
+import tempfile
+import time
+from threading import Event, Lock, Thread
+
+try:
+    import ahocorasick  # pip install pyahocorasick
+except ImportError:
+    ahocorasick = None
+SIGHUP = getattr(Signals, "SIGHUP", None)  # not on Windows
+try:
+    import pyarrow as pa  # pip install pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# tshark fields converted to int in the records, the others stay str
+FIELD_TYPES = {
+    "frame.len": int,
+    "tcp.stream": int,
+    "tcp.seq": int,
+    "tcp.srcport": int,
+    "tcp.dstport": int,
+    "udp.srcport": int,
+    "sip.Status-Code": int,
+    "sip.Expires": int,
+    "sdp.media.port": int,
+}
+
+
+class TsharkParser:
+    """Splits tshark -T fields lines into typed records, a namedtuple with
+    one attribute per field (ip.src -> ip_src) plus the raw line"""
+
+    def __init__(self, fields: list[str]):
+        self.fields = fields
+        self.Record = namedtuple(
+            "TsharkRecord", [self.attr(f) for f in fields] + ["line"]
+        )
+        self.converters = [FIELD_TYPES.get(f) for f in fields]
+
+    @staticmethod
+    def attr(field: str) -> str:
+        return re.sub(r"\W", "_", field).lstrip("_")
+
+    def parse(self, line: str):
+        values = line.rstrip("\n").split("\t")
+        n = len(self.fields)
+        if len(values) != n:
+            values = (values + [""] * n)[:n]
+        for i, conv in enumerate(self.converters):
+            v = values[i]
+            if not v:
+                values[i] = None
+            elif conv and v.isdigit():
+                values[i] = conv(v)
+        return self.Record(*values, line)
+
+
+class TsharkReader(Thread):
+    """Reads tshark stdout in large chunks and queues batches of records.
+
+    The queue is bounded: when the pipeline falls behind the reader blocks,
+    tshark blocks on the full pipe and the capture buffers in the kernel
+    instead of this process growing without limit.
+    """
+
+    CHUNK = 1 << 16
+
+    def __init__(self, stream, parser: TsharkParser, max_batches: int = 1000):
+        Thread.__init__(self, daemon=True)
+        self.stream = stream
+        self.parser = parser
+        self.queue: queue.Queue = queue.Queue(max_batches)
+
+    def run(self):
+        rest = b""
+        try:
+            while chunk := self.stream.read1(self.CHUNK):
+                lines = (rest + chunk).split(b"\n")
+                rest = lines.pop()
+                parse = self.parser.parse
+                self.queue.put(
+                    [parse(line.decode(errors="replace") + "\n") for line in lines]
+                )
+            if rest:
+                self.queue.put([self.parser.parse(rest.decode(errors="replace"))])
+        except Exception as e:
+            logging.error(f"Error reading tshark stdout {e!r}")
+        finally:
+            self.queue.put(None)
+
+    def batches(self):
+        while (batch := self.queue.get()) is not None:
+            yield batch
+
+    def records(self):
+        for batch in self.batches():
+            yield from batch
+
+
+class RecordPipeline:
+    """Fans the records out to the sinks, objects with write(record)/close().
+    Closed in reverse order, so a sink can still log to the ones before it."""
+
+    def __init__(self, sinks: list):
+        self.sinks = sinks
+
+    def write(self, record):
+        for sink in self.sinks:
+            sink.write(record)
+
+    def close(self):
+        for sink in reversed(self.sinks):
+            sink.close()
+
+
+class StdoutPatterns:
+    """Multi pattern stdout filter loaded from a file, one pattern per line:
+
+        [name] literal        case insensitive substring
+        [name] re:regex       case insensitive regex
+        # comment
+
+    The [name] tag is optional (the pattern itself is the tag). The literals
+    are matched with one Aho-Corasick automaton (pyahocorasick) or a trie,
+    the regexes are tested one by one when their combined regex matches.
+    Lines are tagged with the names of all the patterns that matched,
+    overlapping ones included. Reloaded on SIGHUP (not on Windows).
+    """
+
+    LINE = re.compile(r"^(?:\[([^\]]+)\]\s*)?(.+?)\s*$")
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.matcher = self.load()
+
+    def reload(self, *_):
+        try:
+            self.matcher = self.load()
+        except Exception as e:
+            logging.error(f"Error {e!r} reloading {self.filename}, keeping patterns")
+
+    def load(self):
+        literals: dict[str, list[str]] = {}
+        regexes: list[tuple[str, str]] = []
+        with open(self.filename, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip() or line.lstrip().startswith("#"):
+                    continue
+                name, pattern = self.LINE.match(line.strip()).groups()
+                if pattern.startswith("re:"):
+                    re.compile(pattern[3:])
+                    regexes.append((name or pattern[3:], pattern[3:]))
+                else:
+                    literals.setdefault(pattern.lower(), []).append(name or pattern)
+        logging.info(
+            f"Loaded {len(literals)} literal and {len(regexes)} regex patterns"
+            f" from {self.filename}"
+        )
+        literal_matcher = self.compile_literals(literals) if literals else None
+        regex_matcher = None
+        if regexes:
+            # the combined regex rejects the lines matching none in one pass
+            combined = re.compile("|".join(f"(?:{r})" for _, r in regexes), re.I)
+            regex_matcher = (
+                combined,
+                [(name, re.compile(r, re.IGNORECASE)) for name, r in regexes],
+            )
+        return literal_matcher, regex_matcher
+
+    @staticmethod
+    def compile_literals(literals: dict[str, list[str]]):
+        if ahocorasick:
+            automaton = ahocorasick.Automaton()
+            for literal, names in literals.items():
+                automaton.add_word(literal, names)
+            automaton.make_automaton()
+            return lambda text: (names for _, names in automaton.iter(text))
+        # trie of the literals, a regex of their first characters finds the
+        # candidate positions, the trie walk from each of them reports all the
+        # literals starting there, overlapping ones included
+        trie: dict = {}
+        for literal in literals:
+            node = trie
+            for ch in literal:
+                node = node.setdefault(ch, {})
+            node[""] = literals[literal]
+        starts = re.compile("[" + "".join(re.escape(ch) for ch in trie) + "]")
+
+        def match(text: str):
+            for m in starts.finditer(text):
+                node = trie
+                for i in range(m.start(), len(text)):
+                    if (node := node.get(text[i])) is None:
+                        break
+                    if "" in node:
+                        yield node[""]
+
+        return match
+
+    def match(self, text: str) -> list[str]:
+        literal_matcher, regex_matcher = self.matcher
+        tags: dict[str, None] = {}
+        if literal_matcher:
+            for names in literal_matcher(text.lower()):
+                tags.update(dict.fromkeys(names))
+        if regex_matcher:
+            combined, regexes = regex_matcher
+            if combined.search(text):
+                for name, regex in regexes:
+                    if regex.search(text):
+                        tags[name] = None
+        return list(tags)
+
+    def benchmark(self, n_lines: int):
+        """Compares the matcher with the single --stdout-regex path, an
+        alternation of all the patterns searched per line"""
+        literal_matcher, regex_matcher = self.matcher
+        alternation = []
+        with open(self.filename, encoding="utf-8") as f:
+            for line in f:
+                if line.strip() and not line.lstrip().startswith("#"):
+                    pattern = self.LINE.match(line.strip()).group(2)
+                    alternation.append(
+                        pattern[3:] if pattern.startswith("re:") else re.escape(pattern)
+                    )
+        single = re.compile("|".join(alternation), re.IGNORECASE)
+        samples = [
+            f"2024-12-02 10:00:{i % 60:02}.{i:06d}\t10.0.{i % 256}.{i % 97}"
+            f"\t{i % 5000}\tALARM id={i % 10007:05d} ext={1000 + i % 9000} state=ok\n"
+            for i in range(n_lines)
+        ]
+        start = time.perf_counter()
+        matched = sum(1 for s in samples if single.search(s))
+        elapsed = time.perf_counter() - start
+        print(
+            f"re.search   : {n_lines / elapsed:12,.0f} lines/s, {matched} matched"
+        )
+        start = time.perf_counter()
+        matched = sum(1 for s in samples if self.match(s))
+        elapsed = time.perf_counter() - start
+        kind = "aho-corasick" if ahocorasick else "trie"
+        print(f"{kind:12}: {n_lines / elapsed:12,.0f} lines/s, {matched} matched")
 
 
 class ReportFile:
+    """Report sink, echoes the (regex / patterns filtered) lines to stdout and logs
+    them to a daily file rotated every MAX_ENTRIES lines.
+
+    Lines are buffered and written by size (FLUSH_LINES) or time
+    (flush_interval, by a flusher thread). Rotated files are closed and
+    optionally gzip compressed in a background thread.
+    """
+
     cnt: int = 0
     filename: str
     MAX_ENTRIES: int = 500000
+    FLUSH_LINES: int = 4096
     stdout_regex: re.Pattern | None = None
+    stdout_patterns: StdoutPatterns | None = None
     fh = None
 
     def __init__(self, args):
+        self.buffer: list[str] = []
+        self.stdout_buffer: list[str] = []
+        self.lock = Lock()
+        self.closed = Event()
+        self.compress = args.compress_rotated
+        # the terminal dashboard owns stdout
+        self.echo = not (args.dashboard and not args.dashboard_http)
+        self.flush_interval = args.flush_interval
+        if args.stdout_regex:
+            self.stdout_regex = re.compile(args.stdout_regex, re.IGNORECASE)
+        if args.stdout_patterns:
+            self.stdout_patterns = StdoutPatterns(args.stdout_patterns)
+            if SIGHUP:
+                signal(SIGHUP, self.stdout_patterns.reload)
         if args.report_file:
             self.filename_base = args.report_file
-            if args.stdout_regex:
-                self.stdout_regex = re.compile(args.stdout_regex, re.IGNORECASE)
             self.today = date.today()
-            filename = self.filename_base + self.today.strftime("%Y%m%d.log")
+            self.filename = self.filename_base + self.today.strftime("%Y%m%d.log")
             try:
-                self.fh = open(filename, "a", 1)
-                logging.info(f"Opened Log File {filename}")
+                self.fh = open(self.filename, "a")
+                logging.info(f"Opened Log File {self.filename}")
             except Exception as e:
                 logging.info(f"Error {e} when Open Log File {self.filename}")
+        self.flusher = Thread(target=self.flush_loop, daemon=True)
+        self.flusher.start()
 
     def log(self, text: str):
-        if not self.stdout_regex or self.stdout_regex.search(text):
-            print(text, end="")
+        with self.lock:
+            if not self.echo:
+                pass  # stdout is the terminal dashboard
+            elif self.stdout_patterns:
+                if tags := self.stdout_patterns.match(text):
+                    self.stdout_buffer.append(f"[{','.join(tags)}] {text}")
+            elif not self.stdout_regex or self.stdout_regex.search(text):
+                self.stdout_buffer.append(text)
+            if self.fh:
+                self.buffer.append(text)
+            if (
+                len(self.buffer) >= self.FLUSH_LINES
+                or len(self.stdout_buffer) >= self.FLUSH_LINES
+            ):
+                self._flush()
+
+    def flush_loop(self):
+        while not self.closed.wait(self.flush_interval):
+            with self.lock:
+                self._flush()
+
+    def _flush(self):
+        if self.stdout_buffer:
+            sys.stdout.write("".join(self.stdout_buffer))
             sys.stdout.flush()
-        if self.fh:
+            self.stdout_buffer = []
+        if not self.fh or not self.buffer:
+            return
+        lines, self.buffer = self.buffer, []
+        while lines:
             today = date.today()
             if today != self.today or self.cnt > self.MAX_ENTRIES:
-                self.today = today
-                filename = self.filename_base + datetime.now().strftime(
-                    "%Y%m%d_%H%M%S.log"
+                self._rotate(today)
+            n = self.MAX_ENTRIES + 1 - self.cnt
+            self.fh.write("".join(lines[:n]))
+            self.cnt += len(lines[:n])
+            lines = lines[n:]
+        self.fh.flush()
+
+    def _rotate(self, today: date):
+        self.today = today
+        filename = self.filename_base + datetime.now().strftime("%Y%m%d_%H%M%S.log")
+        self.fh.write(f">>> Rotate to Log File {filename}\n")
+        self.cnt = 0
+        try:
+            fh = open(filename, "a")
+        except Exception as e:
+            logging.info(f"Error {e} when Rotate Log File {filename}")
+            return
+        rotated = (self.fh, self.filename)
+        self.fh, self.filename = fh, filename
+        Thread(target=self._close_rotated, args=rotated).start()
+        logging.info(f"Rotate Log File {filename}")
+
+    def _close_rotated(self, fh, filename: str):
+        fh.close()
+        if self.compress:
+            try:
+                with open(filename, "rb") as src:
+                    with gzip.open(filename + ".gz", "wb") as dst:
+                        shutil.copyfileobj(src, dst, 1 << 20)
+                os.unlink(filename)
+            except Exception as e:
+                logging.error(f"Error {e} when compressing {filename}")
+
+    def write(self, record):
+        self.log(record.line)
+
+    def close(self):
+        self.closed.set()
+        with self.lock:
+            self._flush()
+            if self.fh:
+                self.fh.close()
+                self.fh = None
+
+
+class SipDialog:
+    __slots__ = ("call_id", "from_addr", "to_addr", "start", "pdd", "answer", "media")
+
+    def __init__(self, call_id: str, from_addr: str, to_addr: str, start: float):
+        self.call_id = call_id
+        self.from_addr = from_addr
+        self.to_addr = to_addr
+        self.start = start
+        self.pdd = None
+        self.answer = None
+        self.media = None
+
+
+class RollingStats:
+    """Last `size` samples of a metric, percentiles computed on demand"""
+
+    def __init__(self, size: int):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+
+    def summary(self) -> str:
+        s = sorted(self.samples)
+        n = len(s) - 1
+        p50, p90, p99 = (s[round(n * q)] for q in (0.5, 0.9, 0.99))
+        return (
+            f"n={self.count} p50={p50:.1f} p90={p90:.1f} p99={p99:.1f}"
+            f" max={s[-1]:.1f}"
+        )
+
+
+class SipCorrelator:
+    """Sink correlating the sip profile records by Call-ID / CSeq.
+
+    Tracks the transactions (request -> final response latency per method),
+    the INVITE dialogs (post dial delay to 180/183, setup time, duration until
+    BYE) and the REGISTER refresh interval per AOR. Dialogs, transactions and
+    registrations are kept in LRU dicts bounded by max_dialogs, the oldest
+    entries are evicted. Summaries and periodic rolling percentiles (ms, or s
+    for the register refresh) are logged to the report with a "SIP " prefix.
+    """
+
+    WINDOW = 10000
+
+    def __init__(self, report: ReportFile, max_dialogs: int, stats_interval: float):
+        self.report = report
+        self.max_dialogs = max_dialogs
+        self.stats_interval = stats_interval
+        self.transactions: OrderedDict[tuple, tuple[str, float]] = OrderedDict()
+        self.dialogs: OrderedDict[str, SipDialog] = OrderedDict()
+        self.registrations: OrderedDict[str, float] = OrderedDict()
+        self.stats: dict[str, RollingStats] = {}
+        self.next_stats = None
+
+    def add(self, metric: str, value: float):
+        if metric not in self.stats:
+            self.stats[metric] = RollingStats(self.WINDOW)
+        self.stats[metric].add(value)
+
+    def bound(self, lru: OrderedDict, on_evict=None):
+        while len(lru) > self.max_dialogs:
+            _, value = lru.popitem(last=False)
+            if on_evict:
+                on_evict(value, "evicted")
+
+    def write(self, record):
+        if not (record.sip_Call_ID and record.sip_CSeq and record.frame_time_epoch):
+            return
+        t = float(record.frame_time_epoch)
+        call_id = record.sip_Call_ID
+        cseq = record.sip_CSeq
+        method = cseq.rpartition(" ")[2]
+        key = (call_id, cseq)
+        if record.sip_Status_Code is None:
+            self.request(key, method, t, record)
+        elif not isinstance(record.sip_Status_Code, int):
+            pass  # several sip messages in the packet
+        elif (transaction := self.transactions.get(key)) is not None:
+            self.response(key, transaction, record.sip_Status_Code, t, record)
+        if self.next_stats is None:
+            self.next_stats = t + self.stats_interval
+        elif t >= self.next_stats:
+            self.log_stats()
+            self.next_stats = t + self.stats_interval
+
+    def request(self, key: tuple, method: str, t: float, record):
+        if key in self.transactions:
+            return  # retransmission, the latency is from the first request
+        if method != "ACK":  # ACK gets no response, it is not a transaction
+            self.transactions[key] = (method, t)
+            self.bound(self.transactions)
+        if method == "INVITE" and key[0] not in self.dialogs:
+            dialog = SipDialog(key[0], record.sip_from_addr, record.sip_to_addr, t)
+            self.dialogs[key[0]] = dialog
+            self.bound(self.dialogs, self.end_dialog)
+        if (dialog := self.dialogs.get(key[0])) is not None:
+            self.dialogs.move_to_end(key[0])
+            if record.sdp_connection_info_address and not dialog.media:
+                dialog.media = (
+                    f"{record.sdp_connection_info_address}:{record.sdp_media_port}"
+                )
+
+    def response(self, key: tuple, transaction: tuple, status: int, t: float, record):
+        method, start = transaction
+        call_id = key[0]
+        dialog = self.dialogs.get(call_id)
+        if status < 200:
+            if method == "INVITE" and status in (180, 183) and dialog:
+                if dialog.pdd is None:
+                    dialog.pdd = t - dialog.start
+                    self.add("PDD", dialog.pdd * 1000)
+            return
+        del self.transactions[key]
+        self.add(method, (t - start) * 1000)
+        match method:
+            case "REGISTER" if status < 300:
+                aor = record.sip_to_addr or record.sip_from_addr
+                if (last := self.registrations.pop(aor, None)) is not None:
+                    self.add("REGISTER-refresh", t - last)
+                self.registrations[aor] = t
+                self.bound(self.registrations)
+            case "INVITE" if dialog:
+                if status >= 300:
+                    self.end_dialog(self.dialogs.pop(call_id), f"failed {status}", t)
+                elif dialog.answer is None:
+                    dialog.answer = t
+                    self.add("INVITE-setup", (t - dialog.start) * 1000)
+                    if record.sdp_connection_info_address and not dialog.media:
+                        dialog.media = (
+                            f"{record.sdp_connection_info_address}"
+                            f":{record.sdp_media_port}"
+                        )
+            case "BYE" | "CANCEL" if dialog:
+                self.end_dialog(self.dialogs.pop(call_id), method.lower(), t)
+
+    def end_dialog(self, dialog: SipDialog, state: str, t: float | None = None):
+        text = (
+            f"SIP dialog {dialog.call_id} {dialog.from_addr} -> {dialog.to_addr}"
+            f" {state}"
+        )
+        if dialog.pdd is not None:
+            text += f" pdd={dialog.pdd * 1000:.0f}ms"
+        if dialog.answer is not None:
+            text += f" setup={(dialog.answer - dialog.start) * 1000:.0f}ms"
+            if t is not None:
+                text += f" duration={t - dialog.answer:.1f}s"
+        if dialog.media:
+            text += f" media={dialog.media}"
+        self.report.log(text + "\n")
+
+    def log_stats(self):
+        for metric, stats in self.stats.items():
+            self.report.log(f"SIP stats {metric} {stats.summary()}\n")
+        self.report.log(
+            f"SIP stats open dialogs={len(self.dialogs)}"
+            f" transactions={len(self.transactions)}"
+            f" registrations={len(self.registrations)}\n"
+        )
+
+    def close(self):
+        for dialog in self.dialogs.values():
+            self.end_dialog(dialog, "open")
+        self.dialogs.clear()
+        self.log_stats()
+
+
+class ParquetFile:
+    """Columnar report sink, the typed record fields written as zstd
+    compressed Parquet row groups of ROW_GROUP rows. Same rotation as
+    ReportFile: daily files, rotated every MAX_ENTRIES rows.
+
+    frame.time_epoch is stored as a ns timestamp column `time`, the int
+    FIELD_TYPES as int64 (null when tshark returned several values) and the
+    other fields as strings. The formatted _ws.col.Time and the raw line
+    are not stored.
+    """
+
+    ROW_GROUP: int = 65536
+    MAX_ENTRIES: int = ReportFile.MAX_ENTRIES
+
+    def __init__(self, args, fields: list[str]):
+        self.filename_base = args.parquet_file
+        self.columns = []
+        schema = []
+        for f in fields:
+            if f == "_ws.col.Time":
+                continue
+            elif f == "frame.time_epoch":
+                self.columns.append(("time", TsharkParser.attr(f), self.epoch_ns))
+                schema.append(("time", pa.timestamp("ns")))
+            elif FIELD_TYPES.get(f) is int:
+                self.columns.append((f, TsharkParser.attr(f), self.int_or_none))
+                schema.append((f, pa.int64()))
+            else:
+                self.columns.append((f, TsharkParser.attr(f), None))
+                schema.append((f, pa.string()))
+        self.schema = pa.schema(schema)
+        self.rows: dict[str, list] = {name: [] for name, _, _ in self.columns}
+        self.cnt = 0
+        self.writer = None
+        self.today = date.today()
+        self._open(self.filename_base + self.today.strftime("%Y%m%d.parquet"))
+
+    @staticmethod
+    def epoch_ns(value: str | None) -> int | None:
+        if not value:
+            return None
+        sec, _, frac = value.partition(".")
+        return int(sec) * 1_000_000_000 + int(frac[:9].ljust(9, "0"))
+
+    @staticmethod
+    def int_or_none(value) -> int | None:
+        return value if isinstance(value, int) else None
+
+    def _open(self, filename: str):
+        # parquet files cannot be appended to, never reuse a name
+        stem, n = filename.removesuffix(".parquet"), 0
+        while os.path.exists(filename):
+            n += 1
+            filename = f"{stem}_{n}.parquet"
+        self.filename = filename
+        self.writer = pq.ParquetWriter(filename, self.schema, compression="zstd")
+        logging.info(f"Opened Parquet File {filename}")
+
+    def write(self, record):
+        for name, attr, conv in self.columns:
+            value = getattr(record, attr)
+            self.rows[name].append(conv(value) if conv else value)
+        if len(self.rows[self.columns[0][0]]) >= self.ROW_GROUP:
+            self._flush()
+
+    def _flush(self):
+        n = len(self.rows[self.columns[0][0]])
+        while n:
+            today = date.today()
+            if today != self.today or self.cnt >= self.MAX_ENTRIES:
+                self._rotate(today)
+            take = min(n, self.MAX_ENTRIES - self.cnt)
+            table = pa.Table.from_pydict(
+                {name: values[:take] for name, values in self.rows.items()},
+                schema=self.schema,
+            )
+            self.writer.write_table(table)
+            self.rows = {name: values[take:] for name, values in self.rows.items()}
+            self.cnt += take
+            n -= take
+
+    def _rotate(self, today: date):
+        self.today = today
+        self.writer.close()
+        self.cnt = 0
+        self._open(
+            self.filename_base + datetime.now().strftime("%Y%m%d_%H%M%S.parquet")
+        )
+        logging.info(f"Rotate Parquet File {self.filename}")
+
+    def close(self):
+        if self.writer:
+            self._flush()
+            self.writer.close()
+            self.writer = None
+
+
+class RateWindow:
+    """Packets / bytes per second over the last `size` seconds, in a fixed
+    ring of per second slots"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.seconds = [0] * size
+        self.packets = [0] * size
+        self.bytes = [0] * size
+
+    def add(self, now: int, length: int):
+        i = now % self.size
+        if self.seconds[i] != now:
+            self.seconds[i], self.packets[i], self.bytes[i] = now, 0, 0
+        self.packets[i] += 1
+        self.bytes[i] += length
+
+    def rates(self, now: int) -> tuple[float, float, float, float]:
+        """(last second packets, bytes, window average packets/s, bytes/s)"""
+        last = (now - 1) % self.size
+        last_packets = self.packets[last] if self.seconds[last] == now - 1 else 0
+        last_bytes = self.bytes[last] if self.seconds[last] == now - 1 else 0
+        live = [i for i, s in enumerate(self.seconds) if now - self.size < s <= now]
+        packets = sum(self.packets[i] for i in live) / self.size
+        bytes_ = sum(self.bytes[i] for i in live) / self.size
+        return last_packets, last_bytes, packets, bytes_
+
+
+class CountMinTopN:
+    """Approximate top-N keys by weight over a sliding window.
+
+    Two count-min sketches (current and previous window) estimate the
+    weights, a candidate dict bounded to 8*N keys keeps the heavy hitters.
+    Memory does not depend on the number of distinct keys.
+    """
+
+    DEPTH = 4
+
+    def __init__(self, n: int, window: int, width: int = 2048):
+        self.n = n
+        self.window = window
+        self.width = width
+        self.seeds = [0x9E3779B1 * (i + 1) for i in range(self.DEPTH)]
+        self.current = [[0] * width for _ in range(self.DEPTH)]
+        self.previous = [[0] * width for _ in range(self.DEPTH)]
+        self.candidates: dict = {}
+        self.started = None
+
+    def _rotate(self, now: int):
+        if self.started is None:
+            self.started = now
+        elif now - self.started >= self.window:
+            if now - self.started >= 2 * self.window:
+                self.current = [[0] * self.width for _ in range(self.DEPTH)]
+            self.previous = self.current
+            self.current = [[0] * self.width for _ in range(self.DEPTH)]
+            self.started = now
+
+    def _indexes(self, key) -> list[int]:
+        # hashing (seed, key) gives independent rows, a xor of the seed would
+        # only permute the low bits and keep the collisions of the first row
+        return [hash((seed, key)) % self.width for seed in self.seeds]
+
+    def add(self, now: int, key, weight: int = 1):
+        self._rotate(now)
+        estimate = None
+        for row, prev, i in zip(self.current, self.previous, self._indexes(key)):
+            row[i] += weight
+            value = row[i] + prev[i]
+            estimate = value if estimate is None else min(estimate, value)
+        self.candidates[key] = estimate
+        if len(self.candidates) > 8 * self.n:
+            keep = sorted(self.candidates.items(), key=lambda kv: -kv[1])
+            self.candidates = dict(keep[: 4 * self.n])
+
+    def estimate(self, key) -> int:
+        return min(
+            row[i] + prev[i]
+            for row, prev, i in zip(self.current, self.previous, self._indexes(key))
+        )
+
+    def top(self, now: int) -> list[tuple]:
+        self._rotate(now)
+        tops = [(key, self.estimate(key)) for key in self.candidates]
+        tops = [t for t in tops if t[1]]
+        return sorted(tops, key=lambda kv: -kv[1])[: self.n]
+
+
+class Dashboard:
+    """Sink aggregating the records into live metrics refreshed once per
+    second: packets/bytes per second, top-N ip.src, top-N tcp.stream by bytes
+    and snom.alarmid rates. Rendered to the terminal, or served as JSON on
+    http://127.0.0.1:port/ when http_port is set."""
+
+    def __init__(self, args):
+        self.window = args.dashboard
+        self.protocol = args.protocol
+        top_n = args.dashboard_top
+        self.rates = RateWindow(self.window)
+        self.sources = CountMinTopN(top_n, self.window)
+        self.streams = CountMinTopN(top_n, self.window)
+        self.alarms = CountMinTopN(top_n, self.window)
+        self.alarm_rates = RateWindow(self.window)
+        self.total = 0
+        self.lock = Lock()
+        self.snapshot_json = b"{}"
+        self.closed = Event()
+        self.server = None
+        if args.dashboard_http:
+            self.server = ThreadingHTTPServer(
+                ("127.0.0.1", args.dashboard_http), self.handler()
+            )
+            Thread(target=self.server.serve_forever, daemon=True).start()
+            logging.info(f"Dashboard on http://127.0.0.1:{args.dashboard_http}/")
+        self.refresher = Thread(target=self.refresh_loop, daemon=True)
+        self.refresher.start()
+
+    def handler(self):
+        dashboard = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = dashboard.snapshot_json
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def write(self, record):
+        now = int(time.time())
+        length = getattr(record, "frame_len", None) or 0
+        with self.lock:
+            self.total += 1
+            self.rates.add(now, length)
+            if src := getattr(record, "ip_src", None):
+                self.sources.add(now, src)
+            if (stream := getattr(record, "tcp_stream", None)) is not None:
+                self.streams.add(now, stream, length)
+            if alarm := getattr(record, "snom_alarmid", None):
+                self.alarms.add(now, alarm)
+                self.alarm_rates.add(now, 0)
+
+    def snapshot(self) -> dict:
+        now = int(time.time())
+        with self.lock:
+            pps, bps, avg_pps, avg_bps = self.rates.rates(now)
+            snapshot = {
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "protocol": self.protocol,
+                "window": self.window,
+                "total": self.total,
+                "packets/s": pps,
+                "bytes/s": bps,
+                "avg packets/s": round(avg_pps, 1),
+                "avg bytes/s": round(avg_bps, 1),
+                "top ip.src": self.sources.top(now),
+                "top tcp.stream bytes": self.streams.top(now),
+            }
+            if self.protocol == "snom":
+                alarms_ps, _, avg_alarms_ps, _ = self.alarm_rates.rates(now)
+                snapshot["alarms/s"] = alarms_ps
+                snapshot["avg alarms/s"] = round(avg_alarms_ps, 1)
+                snapshot["top snom.alarmid"] = self.alarms.top(now)
+        return snapshot
+
+    def render(self, snapshot: dict) -> str:
+        lines = [
+            f"{snapshot['time']}  {snapshot['protocol']}  total {snapshot['total']}"
+            f"  (averages over {snapshot['window']}s)",
+            f"packets/s {snapshot['packets/s']:>10}"
+            f"  avg {snapshot['avg packets/s']:>12}",
+            f"bytes/s   {snapshot['bytes/s']:>10}  avg {snapshot['avg bytes/s']:>12}",
+        ]
+        if "alarms/s" in snapshot:
+            lines.append(
+                f"alarms/s  {snapshot['alarms/s']:>10}"
+                f"  avg {snapshot['avg alarms/s']:>12}"
+            )
+        for title in ("top ip.src", "top tcp.stream bytes", "top snom.alarmid"):
+            if tops := snapshot.get(title):
+                lines.append(f"{title}:")
+                lines += [f"  {key!s:<40} {value:>12}" for key, value in tops]
+        return "\x1b[H\x1b[2J" + "\n".join(lines) + "\n"
+
+    def refresh_loop(self):
+        while not self.closed.wait(1.0 - time.time() % 1.0):
+            snapshot = self.snapshot()
+            self.snapshot_json = json.dumps(snapshot).encode()
+            if not self.server:
+                sys.stdout.write(self.render(snapshot))
+                sys.stdout.flush()
+
+    def close(self):
+        self.closed.set()
+        if self.server:
+            self.server.shutdown()
+        else:
+            sys.stdout.write(self.render(self.snapshot()))
+
+
+class NewlineFramer:
+    """Messages terminated by \\n (a trailing \\r is stripped)"""
+
+    def split(self, buffer: bytearray) -> list[bytes]:
+        if (end := buffer.rfind(b"\n")) < 0:
+            return []
+        messages = [m.rstrip(b"\r") for m in buffer[:end].split(b"\n")]
+        del buffer[: end + 1]
+        return messages
+
+
+class StxEtxFramer:
+    """Messages between STX (0x02) and ETX (0x03), as sent by the nurse call
+    gateways, the bytes outside the frames are dropped"""
+
+    STX, ETX = 0x02, 0x03
+
+    def split(self, buffer: bytearray) -> list[bytes]:
+        messages = []
+        pos = 0
+        while (start := buffer.find(self.STX, pos)) >= 0:
+            if (end := buffer.find(self.ETX, start + 1)) < 0:
+                pos = start
+                break
+            messages.append(bytes(buffer[start + 1 : end]))
+            pos = end + 1
+        else:
+            pos = len(buffer)
+        del buffer[:pos]
+        return messages
+
+
+class LengthPrefixFramer:
+    """Messages prefixed by their length, `length:2`, `length:4` (big endian)
+    or `length:4:le`; the prefix does not count itself"""
+
+    def __init__(self, spec: str):
+        _, size, *order = spec.split(":")
+        self.size = int(size)
+        if self.size not in (1, 2, 4):
+            raise ValueError(f"length prefix of {size} bytes not supported")
+        self.order = "little" if order == ["le"] else "big"
+
+    def split(self, buffer: bytearray) -> list[bytes]:
+        messages = []
+        pos = 0
+        while pos + self.size <= len(buffer):
+            length = int.from_bytes(buffer[pos : pos + self.size], self.order)
+            if pos + self.size + length > len(buffer):
+                break
+            messages.append(bytes(buffer[pos + self.size : pos + self.size + length]))
+            pos += self.size + length
+        del buffer[:pos]
+        return messages
+
+
+class ChunkFramer:
+    """No framing, every in order chunk is a message (reorder / dedup only)"""
+
+    def split(self, buffer: bytearray) -> list[bytes]:
+        messages = [bytes(buffer)] if buffer else []
+        buffer.clear()
+        return messages
+
+
+class StreamState:
+    __slots__ = (
+        "next_seq",
+        "pending",
+        "pending_bytes",
+        "buffer",
+        "record",
+        "last_seen",
+    )
+
+    def __init__(self):
+        self.next_seq = None
+        self.pending: dict[int, bytes] = {}
+        self.pending_bytes = 0
+        self.buffer = bytearray()
+        self.record = None
+        self.last_seen = 0.0
+
+
+class StreamReassembler:
+    """Pipeline stage between the parser and the sinks for tcp_tap/udp_tap:
+    orders the TCP segments of every tcp.stream direction by tcp.seq, drops
+    retransmitted bytes, frames the byte stream into messages and emits one
+    record per message (msgraw replaced by the message, the payload field
+    cleared). UDP datagrams are framed per ip.src/udp.srcport.
+
+    Out of order segments are held up to max_buffer bytes per direction,
+    then the gap is skipped. Directions idle for idle_timeout seconds, or
+    the oldest above max_streams, are evicted and their partial message
+    emitted.
+    """
+
+    MOD = 1 << 32
+
+    def __init__(self, downstream, parser: TsharkParser, args):
+        self.downstream = downstream
+        self.framer = self.make_framer(args.reassemble)
+        self.max_buffer = args.reassemble_buffer
+        self.max_streams = args.reassemble_max_streams
+        self.idle_timeout = args.reassemble_idle
+        self.tcp = args.protocol == "tcp_tap"
+        fields = [TsharkParser.attr(f) for f in parser.fields]
+        self.msgraw = next(f for f in fields if f.endswith("msgraw"))
+        self.payload = "tcp_payload" if self.tcp else "udp_payload"
+        self.streams: OrderedDict[tuple, StreamState] = OrderedDict()
+        self.stats = dict.fromkeys(
+            ("segments", "messages", "duplicate bytes", "gaps", "evicted"), 0
+        )
+        self.next_evict = 0.0
+
+    @staticmethod
+    def make_framer(spec: str):
+        match spec:
+            case "newline":
+                return NewlineFramer()
+            case "stx-etx":
+                return StxEtxFramer()
+            case "none":
+                return ChunkFramer()
+            case _ if spec.startswith("length:"):
+                return LengthPrefixFramer(spec)
+        raise ValueError(f"unknown framer {spec}")
+
+    def write(self, record):
+        payload = getattr(record, self.payload)
+        if not payload:
+            return
+        data = bytes.fromhex(payload.replace(":", ""))
+        if self.tcp:
+            # the port too, both ends share the ip on loopback captures
+            key = (record.tcp_stream, record.ip_src, record.tcp_srcport)
+        else:
+            key = (record.ip_src, record.udp_srcport)
+        if (state := self.streams.get(key)) is None:
+            state = self.streams[key] = StreamState()
+        else:
+            self.streams.move_to_end(key)
+        state.record = record
+        state.last_seen = now = time.monotonic()
+        self.stats["segments"] += 1
+        if self.tcp and isinstance(record.tcp_seq, int):
+            self.add_segment(state, record.tcp_seq, data)
+        else:
+            state.buffer += data
+        self.emit(state, record)
+        if len(self.streams) > self.max_streams or now >= self.next_evict:
+            self.evict(now)
+
+    def add_segment(self, state: StreamState, seq: int, data: bytes):
+        if state.next_seq is None:
+            state.next_seq = seq
+        diff = (seq - state.next_seq + self.MOD // 2) % self.MOD - self.MOD // 2
+        if diff > 0:
+            if state.pending_bytes + len(data) <= self.max_buffer:
+                if seq not in state.pending:
+                    state.pending[seq] = data
+                    state.pending_bytes += len(data)
+                return
+            # buffer full, give up on the missing bytes
+            self.stats["gaps"] += 1
+            state.buffer.clear()
+            state.next_seq = min(
+                state.pending,
+                key=lambda s: (s - state.next_seq) % self.MOD,
+                default=seq,
+            )
+            self.drain(state)
+            return self.add_segment(state, seq, data)
+        if diff < 0:
+            self.stats["duplicate bytes"] += min(-diff, len(data))
+            data = data[-diff:]
+        if data:
+            state.buffer += data
+            state.next_seq = (state.next_seq + len(data)) % self.MOD
+        self.drain(state)
+
+    def drain(self, state: StreamState):
+        while state.pending:
+            ready = [
+                s
+                for s in state.pending
+                if (s - state.next_seq + self.MOD // 2) % self.MOD <= self.MOD // 2
+            ]
+            if not ready:
+                return
+            for s in ready:
+                data = state.pending.pop(s)
+                state.pending_bytes -= len(data)
+                skip = (state.next_seq - s) % self.MOD
+                if skip < len(data):
+                    state.buffer += data[skip:]
+                    state.next_seq = (s + len(data)) % self.MOD
+                else:
+                    self.stats["duplicate bytes"] += len(data)
+
+    def emit(self, state: StreamState, record):
+        for message in self.framer.split(state.buffer):
+            self.write_message(record, message)
+        if len(state.buffer) > self.max_buffer:
+            # no frame end in sight, emit what we have
+            self.write_message(record, bytes(state.buffer))
+            state.buffer.clear()
+
+    def write_message(self, record, message: bytes):
+        self.stats["messages"] += 1
+        record = record._replace(
+            **{self.msgraw: NativeDecoder.text(message), self.payload: None}
+        )
+        values = record[:-1]
+        line = "\t".join("" if v is None else str(v) for v in values) + "\n"
+        self.downstream.write(record._replace(line=line))
+
+    def evict(self, now: float):
+        self.next_evict = now + 1.0
+        while self.streams:
+            key, state = next(iter(self.streams.items()))
+            if (
+                len(self.streams) <= self.max_streams
+                and now - state.last_seen < self.idle_timeout
+            ):
+                break
+            del self.streams[key]
+            self.stats["evicted"] += 1
+            if state.buffer:
+                self.write_message(state.record, bytes(state.buffer))
+
+    def close(self):
+        for state in self.streams.values():
+            if state.buffer:
+                self.write_message(state.record, bytes(state.buffer))
+        self.streams.clear()
+        logging.info(
+            "Reassembly " + ", ".join(f"{k} {v}" for k, v in self.stats.items())
+        )
+        self.downstream.close()
+
+
+class PcapFile:
+    """Memory mapped pcap / pcapng reader, yields
+    (timestamp, linktype, frame length, frame bytes) per packet"""
+
+    PCAPNG_SHB = 0x0A0D0D0A
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.malformed = 0  # skipped records/blocks, a truncated tail counts once
+
+    def packets(self, start: int | None = None, end: int | None = None):
+        if os.path.getsize(self.filename) < 24:
+            return  # an empty file cannot be mapped
+        with open(self.filename, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            if len(mm) < 24:
+                return
+            if struct.unpack_from("<I", mm)[0] == self.PCAPNG_SHB:
+                yield from self._pcapng(mm)
+            else:
+                yield from self._pcap(mm, start, end)
+
+    def split(self, parts: int) -> list[tuple[int | None, int | None]]:
+        """Byte ranges of about the same size, on packet boundaries.
+        Only classic pcap files are split, pcapng blocks need the interfaces
+        described earlier in the file."""
+        size = os.path.getsize(self.filename)
+        if parts < 2 or size < 24:
+            return [(None, None)]
+        with open(self.filename, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            bo = {b"\xd4\xc3\xb2\xa1": "<", b"\x4d\x3c\xb2\xa1": "<"}.get(mm[:4])
+            if bo is None:
+                if mm[:4] not in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+                    return [(None, None)]
+                bo = ">"
+            caplen = struct.Struct(bo + "I")
+            step = size // parts
+            ranges = []
+            pos = start = 24
+            # hop over the record headers only, the packet data is not touched
+            while pos + 16 <= size:
+                if pos - start >= step:
+                    ranges.append((start, pos))
+                    start = pos
+                pos += 16 + caplen.unpack_from(mm, pos + 8)[0]
+            ranges.append((start, size))
+        return ranges
+
+    def _pcap(self, mm, start: int = 0, end: int | None = None):
+        magic = mm[:4]
+        match magic:
+            case b"\xd4\xc3\xb2\xa1":
+                bo, scale = "<", 1e-6
+            case b"\xa1\xb2\xc3\xd4":
+                bo, scale = ">", 1e-6
+            case b"\x4d\x3c\xb2\xa1":
+                bo, scale = "<", 1e-9
+            case b"\xa1\xb2\x3c\x4d":
+                bo, scale = ">", 1e-9
+            case _:
+                raise ValueError(f"{self.filename} is not a pcap/pcapng file")
+        linktype = struct.unpack_from(bo + "I", mm, 20)[0] & 0x0FFFFFFF
+        record = struct.Struct(bo + "IIII")
+        pos = start or 24
+        end = len(mm) if end is None else end
+        while pos + 16 <= end:
+            sec, frac, caplen, origlen = record.unpack_from(mm, pos)
+            pos += 16
+            if pos + caplen > len(mm):
+                self.malformed += 1  # file cut while capturing
+                return
+            yield sec + frac * scale, linktype, origlen, mm[pos : pos + caplen]
+            pos += caplen
+
+    def _pcapng(self, mm):
+        pos = 0
+        bo = "<"
+        interfaces: list[tuple[int, float]] = []
+        size = len(mm)
+        while pos + 12 <= size:
+            btype = struct.unpack_from(bo + "I", mm, pos)[0]
+            if btype == self.PCAPNG_SHB:
+                bo = "<" if mm[pos + 8 : pos + 12] == b"\x4d\x3c\x2b\x1a" else ">"
+                interfaces = []
+            blen = struct.unpack_from(bo + "I", mm, pos + 4)[0]
+            if blen < 12 or pos + blen > size:
+                # corrupted length or file cut while capturing, no next block
+                self.malformed += 1
+                return
+            try:
+                match btype:
+                    case 1:  # interface description
+                        linktype = struct.unpack_from(bo + "H", mm, pos + 8)[0]
+                        resol = self._tsresol(mm, bo, pos + 16, pos + blen - 4)
+                        interfaces.append((linktype, resol))
+                    case 6:  # enhanced packet
+                        if_id, ts_high, ts_low, caplen, origlen = struct.unpack_from(
+                            bo + "IIIII", mm, pos + 8
+                        )
+                        linktype, resol = interfaces[if_id]
+                        if 28 + caplen > blen:
+                            raise ValueError(f"caplen {caplen} past the block end")
+                        data = mm[pos + 28 : pos + 28 + caplen]
+                        ts = ((ts_high << 32) | ts_low) * resol
+                        yield ts, linktype, origlen, data
+            except (struct.error, IndexError, ValueError):
+                self.malformed += 1
+            pos += blen
+
+    @staticmethod
+    def _tsresol(mm, bo: str, pos: int, end: int) -> float:
+        while pos + 4 <= end:
+            code, length = struct.unpack_from(bo + "HH", mm, pos)
+            if code == 0:
+                break
+            if code == 9:  # if_tsresol
+                v = mm[pos + 4]
+                return 2.0 ** -(v & 0x7F) if v & 0x80 else 10.0**-v
+            pos += 4 + (length + 3) // 4 * 4
+        return 1e-6
+
+
+class NativeDecoder:
+    """Decodes Ethernet/SLL/raw IPv4/IPv6 UDP and TCP headers with struct and
+    emits the same records as tshark for the simple profiles, without
+    spawning tshark. Filters: the profile default, `[udp|tcp] port N` /
+    `host A` capture filters and `-d udp.port==N,...` for the tap profiles.
+    """
+
+    PROFILES = ("tcp_tap", "udp_tap", "tcp-conn", "json")
+    # fields decoded per profile, after the time
+    PROFILE_FIELDS = {"tcp_tap": 3, "udp_tap": 3, "tcp-conn": 2, "json": 3}
+    TCP_FLAGS = (
+        (0x02, "SYN"),
+        (0x01, "FIN"),
+        (0x04, "RST"),
+        (0x08, "PSH"),
+        (0x10, "ACK"),
+    )
+    ESCAPES = {b: f"\\x{b:02x}" for b in range(256) if not 32 <= b < 127}
+
+    def __init__(self, args, parser: TsharkParser):
+        self.protocol = args.protocol
+        self.parser = parser
+        self.time_format = args.time_format
+        self.ports: set[int] = set()
+        self.hosts: set[str] = set()
+        self.transport = {"tcp_tap": 6, "tcp-conn": 6, "udp_tap": 17, "json": 17}[
+            self.protocol
+        ]
+        if args.decode_as:
+            if m := re.match(r"(udp|tcp)\.port==(\d+)", args.decode_as):
+                self.ports.add(int(m.group(2)))
+            else:
+                raise ValueError(f"native mode cannot decode as {args.decode_as}")
+        if args.capture_filter:
+            self._parse_capture_filter(args.capture_filter)
+        if args.display_filter:
+            raise ValueError("native mode does not support display filters")
+        # fields appended to the profile ones (reassembly, dashboard, parquet)
+        self.extras = parser.fields[1 + self.PROFILE_FIELDS[self.protocol] :]
+        self.streams: dict[tuple, int] = {}
+        self.isn: dict[tuple, int] = {}
+        self.first = self.prev = None
+        self.malformed = 0
+
+    def _parse_capture_filter(self, capture_filter: str):
+        for term in re.split(r"\s+and\s+", capture_filter.strip()):
+            if m := re.fullmatch(r"(?:(udp|tcp)\s+)?port\s+(\d+)", term):
+                if m.group(1) and {"udp": 17, "tcp": 6}[m.group(1)] != self.transport:
+                    raise ValueError(f"capture filter {term} excludes {self.protocol}")
+                self.ports.add(int(m.group(2)))
+            elif m := re.fullmatch(r"host\s+(\S+)", term):
+                self.hosts.add(m.group(1))
+            elif term not in ("udp", "tcp"):
+                raise ValueError(f"native mode cannot apply capture filter {term}")
+
+    def records(self, filename: str):
+        for _, record in self.timed_records(filename):
+            yield record
+
+    def timed_records(
+        self, filename: str, start: int | None = None, end: int | None = None
+    ):
+        pcap = PcapFile(filename)
+        try:
+            for ts, linktype, length, frame in pcap.packets(start, end):
+                try:
+                    if (packet := self.decode(linktype, frame)) is None:
+                        continue
+                    values = self.fields(packet, length)
+                except (struct.error, IndexError, ValueError):
+                    # truncated (snaplen) or malformed frame
+                    self.malformed += 1
+                    continue
+                if values is not None:
+                    values += [self.extra(f, ts, length, packet) for f in self.extras]
+                    yield ts, self.record([self.format_time(ts)] + values)
+        finally:
+            self.malformed += pcap.malformed
+
+    @staticmethod
+    def extra(field: str, ts: float, length: int, packet):
+        match field:
+            case "frame.len":
+                return length
+            case "frame.time_epoch":
+                return f"{ts:.9f}"
+            case "tcp.srcport":
+                return packet[3]
+            case "tcp.seq":
+                return packet[5][0]
+            case "tcp.payload" | "udp.payload":
+                return packet[6].hex()
+
+    def record(self, values: list):
+        line = "\t".join("" if v is None else str(v) for v in values) + "\n"
+        return self.parser.Record(*values, line)
+
+    @staticmethod
+    def decode(linktype: int, frame: bytes):
+        match linktype:
+            case 1:  # ethernet
+                ethertype = struct.unpack_from("!H", frame, 12)[0]
+                pos = 14
+                while ethertype in (0x8100, 0x88A8):  # vlan tags
+                    ethertype = struct.unpack_from("!H", frame, pos + 2)[0]
+                    pos += 4
+            case 113:  # linux cooked
+                ethertype = struct.unpack_from("!H", frame, 14)[0]
+                pos = 16
+            case 276:  # linux cooked v2
+                ethertype = struct.unpack_from("!H", frame, 0)[0]
+                pos = 20
+            case 101 | 12 | 14:  # raw ip
+                ethertype = 0x86DD if frame[0] >> 4 == 6 else 0x0800
+                pos = 0
+            case 0:  # null / loopback
+                ethertype = 0x86DD if frame[4] >> 4 == 6 else 0x0800
+                pos = 4
+            case _:
+                return None
+        if ethertype == 0x0800:
+            ihl = (frame[pos] & 0x0F) * 4
+            if struct.unpack_from("!H", frame, pos + 6)[0] & 0x1FFF:
+                return None  # not the first fragment
+            proto = frame[pos + 9]
+            src = socket.inet_ntop(socket.AF_INET, frame[pos + 12 : pos + 16])
+            dst = socket.inet_ntop(socket.AF_INET, frame[pos + 16 : pos + 20])
+            # total length 0 with TCP segmentation offload, use the frame
+            end = pos + (struct.unpack_from("!H", frame, pos + 2)[0] or len(frame))
+            pos += ihl
+        elif ethertype == 0x86DD:
+            proto = frame[pos + 6]
+            src = socket.inet_ntop(socket.AF_INET6, frame[pos + 8 : pos + 24])
+            dst = socket.inet_ntop(socket.AF_INET6, frame[pos + 24 : pos + 40])
+            end = pos + 40 + struct.unpack_from("!H", frame, pos + 4)[0]
+            pos += 40
+            while proto in (0, 43, 60):  # hop-by-hop, routing, destination opts
+                proto = frame[pos]
+                pos += (frame[pos + 1] + 1) * 8
+        else:
+            return None
+        end = min(end, len(frame))
+        if proto == 17:
+            sport, dport = struct.unpack_from("!HH", frame, pos)
+            return proto, src, dst, sport, dport, None, frame[pos + 8 : end]
+        if proto == 6:
+            sport, dport, seq, ack, off_flags, win = struct.unpack_from(
+                "!HHIIHH", frame, pos
+            )
+            payload = frame[pos + (off_flags >> 12) * 4 : end]
+            tcp = (seq, ack, off_flags & 0x3F, win)
+            return proto, src, dst, sport, dport, tcp, payload
+        return None
+
+    def fields(self, packet, length: int) -> list | None:
+        proto, src, dst, sport, dport, tcp, payload = packet
+        if proto != self.transport:
+            return None
+        if self.ports and sport not in self.ports and dport not in self.ports:
+            return None
+        if self.hosts and src not in self.hosts and dst not in self.hosts:
+            return None
+        match self.protocol:
+            case "udp_tap":
+                return [src, sport, self.text(payload)] if payload else None
+            case "tcp_tap":
+                if not payload:
+                    return None
+                return [src, self.stream(src, sport, dst, dport), self.text(payload)]
+            case "json":
+                members = self.json_members(payload)
+                return [src, sport, members] if members is not None else None
+            case "tcp-conn":
+                seq, ack, flags, win = tcp
+                if not flags & 0x07:  # SYN/FIN/RST
+                    return None
+                return [length, self.tcp_info(src, sport, dst, dport, tcp, payload)]
+
+    def stream(self, src, sport, dst, dport) -> int:
+        if (src, sport) < (dst, dport):
+            key = (src, sport, dst, dport)
+        else:
+            key = (dst, dport, src, sport)
+        if key not in self.streams:
+            self.streams[key] = len(self.streams)
+        return self.streams[key]
+
+    def tcp_info(self, src, sport, dst, dport, tcp, payload) -> str:
+        seq, ack, flags, win = tcp
+        # relative sequence numbers like tshark
+        isn = self.isn.setdefault((src, sport, dst, dport), seq)
+        peer_isn = self.isn.get((dst, dport, src, sport))
+        names = ",".join(n for bit, n in self.TCP_FLAGS if flags & bit)
+        info = f"{sport} → {dport} [{names}] Seq={(seq - isn) & 0xFFFFFFFF}"
+        if flags & 0x10 and peer_isn is not None:
+            info += f" Ack={(ack - peer_isn) & 0xFFFFFFFF}"
+        return info + f" Win={win} Len={len(payload)}"
+
+    @staticmethod
+    def text(payload: bytes) -> str:
+        return payload.decode("latin-1").translate(NativeDecoder.ESCAPES)
+
+    @staticmethod
+    def json_members(payload: bytes) -> str | None:
+        if not payload or payload[:1] not in (b"{", b"["):
+            return None
+        try:
+            obj = json.loads(payload)
+        except ValueError:
+            return None
+        members = []
+
+        def walk(o):
+            if isinstance(o, dict):
+                for k, v in o.items():
+                    if isinstance(v, (dict, list)):
+                        walk(v)
+                    else:
+                        members.append(f"{k}:{json.dumps(v).strip('\"')}")
+            elif isinstance(o, list):
+                for v in o:
+                    walk(v)
+
+        walk(obj)
+        return ",".join(members)
+
+    def format_time(self, ts: float) -> str:
+        if self.first is None:
+            self.first = self.prev = ts
+        delta, self.prev = ts - self.prev, ts
+        match self.time_format:
+            case "ad":
+                return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S.%f")
+            case "a":
+                return datetime.fromtimestamp(ts).strftime("%H:%M:%S.%f")
+            case "adoy":
+                return datetime.fromtimestamp(ts).strftime("%Y/%j %H:%M:%S.%f")
+            case "ud":
+                return datetime.fromtimestamp(ts, timezone.utc).strftime(
+                    "%Y-%m-%d %H:%M:%S.%f"
+                )
+            case "u":
+                return datetime.fromtimestamp(ts, timezone.utc).strftime("%H:%M:%S.%f")
+            case "udoy":
+                return datetime.fromtimestamp(ts, timezone.utc).strftime(
+                    "%Y/%j %H:%M:%S.%f"
+                )
+            case "e":
+                return f"{ts:.6f}"
+            case "r":
+                return f"{ts - self.first:.6f}"
+            case _:  # d / dd, every packet is displayed
+                return f"{delta:.6f}"
+
+
+class ShardAnalyzer:
+    """Batch mode: every capture file (or byte range of a large classic pcap in
+    native mode) is analyzed in a worker process into a shard file of
+    `epoch<TAB>record line`, the shards are then merged in timestamp order."""
+
+    # tcp stream ids / relative sequences need the whole file in one shard
+    SPLITTABLE = ("udp_tap", "json")
+
+    def __init__(self, my_tshark, args):
+        self.my_tshark = my_tshark
+        self.args = args
+        self.jobs = args.jobs or os.cpu_count() or 1
+        path = pathlib.Path(args.from_glob)
+        if path.is_dir():
+            files = [f for f in path.iterdir() if f.is_file()]
+        else:
+            files = [pathlib.Path(f) for f in glob.glob(args.from_glob)]
+        # rotated captures are named in time order
+        self.files = sorted(str(f) for f in files)
+
+    def shards(self) -> list[tuple[str, int | None, int | None]]:
+        shards = []
+        split = self.args.native and self.args.protocol in self.SPLITTABLE
+        for f in self.files:
+            if split and len(self.files) < self.jobs:
+                parts = -(-self.jobs // len(self.files))
+                shards += [(f, s, e) for s, e in PcapFile(f).split(parts)]
+            else:
+                shards.append((f, None, None))
+        return shards
+
+    def run(self):
+        if not self.files:
+            logging.error(f"No capture files matched {self.args.from_glob}")
+            return
+        shards = self.shards()
+        logging.info(
+            f"Analyzing {len(self.files)} files in {len(shards)} shards"
+            f" on {self.jobs} processes"
+        )
+        start = time.monotonic()
+        with tempfile.TemporaryDirectory(prefix="my_shark_") as tmp_dir:
+            outputs = [
+                os.path.join(tmp_dir, f"shard{n:05d}") for n in range(len(shards))
+            ]
+            with ProcessPoolExecutor(self.jobs) as pool:
+                futures = [
+                    pool.submit(
+                        analyze_shard,
+                        self.args,
+                        self.my_tshark.p_args,
+                        self.my_tshark.fields,
+                        shard,
+                        out,
+                    )
+                    for shard, out in zip(shards, outputs)
+                ]
+                count = 0
+                for future, (filename, _, _) in zip(futures, shards):
+                    try:
+                        count += future.result()
+                    except Exception as e:
+                        logging.error(f"Error analyzing {filename} {e!r}")
+            logging.info(
+                f"{count} records analyzed in {time.monotonic() - start:.1f}s,"
+                " merging"
+            )
+            self.merge(outputs)
+
+    def merge(self, outputs: list[str]):
+        parser = self.my_tshark.parser
+        pipeline = self.my_tshark.pipeline
+        files = [open(out, encoding="utf-8") for out in outputs if os.path.exists(out)]
+        try:
+            lines = heapq.merge(*files, key=lambda line: float(line.split("\t", 1)[0]))
+            for line in lines:
+                pipeline.write(parser.parse(line.split("\t", 1)[1]))
+        except KeyboardInterrupt:
+            print("\nCtrl-C Received. EXIT.")
+        finally:
+            for f in files:
+                f.close()
+            pipeline.close()
+
+
+def analyze_shard(args, p_args: list[str], fields: list[str], shard, out: str) -> int:
+    filename, start, end = shard
+    count = 0
+    with open(out, "w", encoding="utf-8") as fh:
+        if args.native:
+            decoder = NativeDecoder(args, TsharkParser(fields))
+            for ts, record in decoder.timed_records(filename, start, end):
+                fh.write(f"{ts:.9f}\t{record.line}")
+                count += 1
+            if decoder.malformed:
+                logging.warning(
+                    f"Skipped {decoder.malformed} malformed frames in {filename}"
                 )
-                self.fh.write(f">>> Rotate to Log File {filename}\n")
-                self.cnt = 0
-                fh = self.fh
+            return count
+        # the epoch is added as the last field, only for ordering the merge
+        p_args = p_args[:2] + ["-r", filename] + p_args[2:] + ["-e", "frame.time_epoch"]
+        p = subprocess.Popen(
+            p_args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        )
+        for line in p.stdout:
+            line, _, epoch = line.rstrip("\n").rpartition("\t")
+            fh.write(f"{epoch or 0}\t{line}\n")
+            count += 1
+        if p.wait():
+            raise RuntimeError(f"tshark exit code {p.returncode}")
+    return count
+
+
+class CaptureWorker(Thread):
+    """Runs the tshark of one interface/profile pair, restarting it with
+    exponential backoff when it exits, and queues its record batches"""
+
+    BACKOFF_MAX = 60.0
+    DROPPED = re.compile(r"(\d+) packets? dropped", re.I)
+    CAPTURED = re.compile(r"^(\d+) packets? captured", re.I)
+
+    def __init__(self, name: str, my_tshark, out: queue.Queue, stopping: Event):
+        Thread.__init__(self, name=name, daemon=True)
+        self.my_tshark = my_tshark
+        self.out = out
+        self.stopping = stopping
+        self.p = None
+        self.restarts = 0
+        self.captured = 0
+        self.dropped = 0
+
+    def run(self):
+        backoff = 1.0
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            self.p = subprocess.Popen(
+                self.my_tshark.p_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            stderr = Thread(
+                target=self.read_stderr, args=(self.p.stderr,), daemon=True
+            )
+            stderr.start()
+            reader = TsharkReader(self.p.stdout, self.my_tshark.parser)
+            reader.start()
+            for batch in reader.batches():
+                self.out.put(batch)
+            exit_code = self.p.wait()
+            stderr.join(1.0)
+            if self.stopping.is_set():
+                break
+            if time.monotonic() - started > self.BACKOFF_MAX:
+                backoff = 1.0
+            self.restarts += 1
+            logging.warning(
+                f"{self.name} tshark exited with code {exit_code},"
+                f" restart {self.restarts} in {backoff:.0f}s"
+            )
+            self.stopping.wait(backoff)
+            backoff = min(backoff * 2, self.BACKOFF_MAX)
+
+    def read_stderr(self, stream):
+        # tshark reports the capture statistics on stderr when it exits
+        for line in stream:
+            line = line.decode(errors="replace").strip()
+            if m := self.DROPPED.search(line):
+                self.dropped += int(m.group(1))
+            elif m := self.CAPTURED.search(line):
+                self.captured += int(m.group(1))
+            elif line and not line.startswith("Capturing on"):
+                logging.warning(f"{self.name} tshark: {line}")
+
+    def stop(self):
+        if self.p and self.p.poll() is None:
+            self.p.send_signal(SIGINT)
+
+    def stats(self) -> str:
+        return (
+            f"{self.name} captured {self.captured} dropped {self.dropped}"
+            f" restarts {self.restarts}"
+        )
+
+
+class CaptureSupervisor:
+    """Captures several interface[:profile] pairs at once, one CaptureWorker
+    each, and merges their records in frame.time_epoch order: records are
+    held in a heap for `reorder_window` seconds before being written to the
+    shared pipeline."""
+
+    def __init__(self, args, extra_args, specs: list[tuple[str, str]]):
+        self.reorder_window = args.reorder_window
+        self.queue = queue.Queue(maxsize=1000)
+        self.stopping = Event()
+        self.workers = []
+        for interface, profile in specs:
+            worker_args = Namespace(**vars(args))
+            worker_args.interface, worker_args.protocol = interface, profile
+            worker_args.dry_run = False
+            my_tshark = MyTshark(worker_args, extra_args, supervised=True)
+            name = f"{interface}:{profile}"
+            self.workers.append(
+                CaptureWorker(name, my_tshark, self.queue, self.stopping)
+            )
+        if args.dry_run:
+            for worker in self.workers:
+                print(f"{worker.name}: {worker.my_tshark}")
+            exit(0)
+        # with several profiles only the generic sinks apply
+        self.pipeline = self.workers[0].my_tshark.make_pipeline(args)
+
+    def run(self):
+        heap = []
+        counter = itertools.count()
+        for worker in self.workers:
+            worker.start()
+        try:
+            while True:
                 try:
-                    self.fh = open(filename, "a", 1)
-                    fh.close()
-                    logging.info(f"Rotate Log File {filename}")
-                except Exception as e:
-                    logging.info(f"Error {e} when Rotate Log File {filename}")
-            self.fh.write(text)
-            self.fh.flush()
-            self.cnt += 1
+                    batch = self.queue.get(timeout=self.reorder_window / 4)
+                except queue.Empty:
+                    batch = []
+                for record in batch:
+                    epoch = float(record.frame_time_epoch or 0)
+                    heapq.heappush(heap, (epoch, next(counter), record))
+                watermark = time.time() - self.reorder_window
+                while heap and heap[0][0] <= watermark:
+                    self.pipeline.write(heapq.heappop(heap)[2])
+        except KeyboardInterrupt:
+            print("\nCtrl-C Received. EXIT.")
+        except Exception as e:
+            logging.error(f"Error merging capture records {e!r}")
+        finally:
+            self.stopping.set()
+            for worker in self.workers:
+                worker.stop()
+            for worker in self.workers:
+                worker.join(5.0)
+            while not self.queue.empty():
+                for record in self.queue.get_nowait():
+                    epoch = float(record.frame_time_epoch or 0)
+                    heapq.heappush(heap, (epoch, next(counter), record))
+            while heap:
+                self.pipeline.write(heapq.heappop(heap)[2])
+            self.pipeline.close()
+            for worker in self.workers:
+                logging.info(worker.stats())
 
 
 class MyTshark:
-    def __init__(self, args, extra_args):
-        self.p_args = ["tshark", "-Q", "-i"]
+    PROTOCOLS = [
+        "snom",
+        "tcp-conn",
+        "mqtt",
+        "sip",
+        "json",
+        "tls_json",
+        "udp_tap",
+        "tcp_tap",
+        "en6080",
+        "mgcp",
+        "other",
+    ]
+
+    def __init__(self, args, extra_args, supervised: bool = False):
+        # supervised workers keep the stderr statistics (no -Q), add the epoch
+        # for the merge and share the supervisor pipeline
+        self.supervised = supervised
+        self.p_args = ["tshark"] if supervised else ["tshark", "-Q"]
         self.p = None
         self._prepare(args, extra_args)
+        self.fields = [
+            self.p_args[i + 1] for i, a in enumerate(self.p_args[:-1]) if a == "-e"
+        ]
+        self.parser = TsharkParser(self.fields)
+        self.native = None
+        if args.native and args.from_file:
+            self.native = NativeDecoder(args, self.parser)
+            self.from_file = args.from_file
+        self.pipeline = None if supervised else self.make_pipeline(args)
+        self.batch = ShardAnalyzer(self, args) if args.from_glob else None
+
+    def make_pipeline(self, args):
         self.report_file = ReportFile(args)
+        sinks = [self.report_file]
+        if args.parquet_file:
+            sinks.append(ParquetFile(args, self.fields))
+        if args.dashboard:
+            sinks.append(Dashboard(args))
+        if args.sip_correlate:
+            sinks.append(
+                SipCorrelator(
+                    self.report_file, args.sip_max_dialogs, args.sip_stats_interval
+                )
+            )
+        pipeline = RecordPipeline(sinks)
+        if args.reassemble:
+            pipeline = StreamReassembler(pipeline, self.parser, args)
+        return pipeline
 
     def _prepare(self, args, extra_args):
+        if args.native:
+            # same fields as tshark, from the file read in process
+            self.p_args += ["-e", "_ws.col.Time"]
+            self.add_protocol_args(args.protocol)
+            self.add_reassemble_args(args)
+            if args.dashboard and "frame.len" not in self.p_args:
+                self.p_args += ["-e", "frame.len"]
+            if args.parquet_file:
+                self.p_args += ["-e", "frame.time_epoch"]
+            if args.dry_run:
+                source = args.from_file or args.from_glob
+                print(f"native {args.protocol} decoding of {source}")
+                exit(0)
+            return
         if args.interface:
-            self.p_args.append(self.select_interface(args.interface))
+            self.p_args += ["-i", self.select_interface(args.interface)]
         elif args.from_file:
-            self.p_args += ["r", args.from_file]
-        proto_filter = self.add_proto_capture_filter_args(
-            args.protocol, args.capture_filter
-        )
-        if proto_filter:
-            self.p_args += ["-f", proto_filter]
-        else:
-            logging.warning("Capturing without any filter !!!")
-
-        if args.display_filter:
-            self.p_args += ["-Y", args.display_filter]
-        else:
-            proto_filter = self.add_proto_display_filter_args(args.protocol)
+            self.p_args += ["-r", args.from_file]
+        # tshark refuses capture filters when reading files (-r and the
+        # --from-glob shards), the display filters below select the same packets
+        if args.interface:
+            proto_filter = self.add_proto_capture_filter_args(
+                args.protocol, args.capture_filter
+            )
             if proto_filter:
-                self.p_args += ["-Y", proto_filter]
+                self.p_args += ["-f", proto_filter]
+            else:
+                logging.warning("Capturing without any filter !!!")
+
+        display_filter = args.display_filter or self.add_proto_display_filter_args(
+            args.protocol
+        )
+        if not args.interface and args.protocol == "tcp-conn":
+            read_filter = "tcp.flags.syn==1||tcp.flags.fin==1||tcp.flags.reset==1"
+            if display_filter:
+                read_filter = f"({display_filter}) && ({read_filter})"
+            display_filter = read_filter
+        if display_filter:
+            self.p_args += ["-Y", display_filter]
         if args.decode_as:
             self.p_args += ["-d", args.decode_as]
         self.p_args += ["-l", "-T", "fields"]
         self.p_args += ["-e", "_ws.col.Time", "-t", args.time_format]
         self.add_protocol_args(args.protocol)
+        self.add_reassemble_args(args)
+        if args.sip_correlate:
+            self.p_args += ["-e", "sip.Call-ID", "-e", "frame.time_epoch"]
+        if args.dashboard and "frame.len" not in self.p_args:
+            self.p_args += ["-e", "frame.len"]
+        if (
+            args.parquet_file or self.supervised
+        ) and "frame.time_epoch" not in self.p_args:
+            self.p_args += ["-e", "frame.time_epoch"]
         self.p_args += extra_args
 
         if args.dry_run:
@@ -92,23 +1841,52 @@ class MyTshark:
             exit(0)
 
     def run(self):
+        if self.batch:
+            return self.batch.run()
+        if self.native:
+            return self.run_native()
         self.p = subprocess.Popen(self.p_args, stdout=subprocess.PIPE)
+        reader = TsharkReader(self.p.stdout, self.parser)
+        reader.start()
+        exit_code = None
         try:
-            while (exit_code := self.p.poll()) == None:
-                line = self.p.stdout.readline().decode()
-                self.report_file.log(line)
+            for record in reader.records():
+                self.pipeline.write(record)
+            exit_code = self.p.wait()
         except KeyboardInterrupt:
             print("\nCtrl-C Received. EXIT.")
         except Exception as e:
-            logging.error(f"Error reading tshark stdout {e!r}")
+            logging.error(f"Error processing tshark records {e!r}")
         finally:
+            self.pipeline.close()
             if exit_code:
                 logging.error(f"tshark unexpected exit with code {exit_code}.")
             # self.p.send_signal(SIGINT)
 
+    def run_native(self):
+        try:
+            for record in self.native.records(self.from_file):
+                self.pipeline.write(record)
+        except KeyboardInterrupt:
+            print("\nCtrl-C Received. EXIT.")
+        except Exception as e:
+            logging.error(f"Error decoding {self.from_file} {e!r}")
+        finally:
+            if self.native.malformed:
+                logging.warning(f"Skipped {self.native.malformed} malformed frames")
+            self.pipeline.close()
+
     def __str__(self):
         return "tshark '" + "' '".join(self.p_args[1:]) + "'"
 
+    def add_reassemble_args(self, args):
+        match args.protocol if args.reassemble else None:
+            case "tcp_tap":
+                self.p_args += ["-e", "tcp.srcport", "-e", "tcp.seq"]
+                self.p_args += ["-e", "tcp.payload"]
+            case "udp_tap":
+                self.p_args += ["-e", "udp.payload"]
+
     def add_protocol_args(self, proto):
         match proto:
             case "tcp_tap":
@@ -207,27 +1985,31 @@ Chossing no {if_matches[0].group(1)}.
             description=f"{pathlib.Path(__file__).name} argument parser"
         )
 
-        parser.add_argument("-i", "--interface", help="the interface to capture from")
+        parser.add_argument(
+            "-i",
+            "--interface",
+            help="the interface to capture from, repeat as interface[:profile] to"
+            " capture several at once",
+            action="append",
+        )
         parser.add_argument(
             "-p",
             "--protocol",
             default="other",
             help="Provide the protocol",
-            choices=[
-                "snom",
-                "tcp-conn",
-                "mqtt",
-                "sip",
-                "json",
-                "tls_json",
-                "udp_tap",
-                "tcp_tap",
-                "en6080",
-                "mgcp",
-                "other",
-            ],
+            choices=MyTshark.PROTOCOLS,
         )
         parser.add_argument("-r", "--from-file", help="the pcap capture file to read")
+        parser.add_argument(
+            "--from-glob",
+            help="batch mode, glob or directory of capture files analyzed in parallel",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            help="batch mode worker processes (default all cores)",
+            type=int,
+        )
         parser.add_argument("-f", "--capture-filter", help="the pcap capture filter")
         parser.add_argument(
             "-d",
@@ -250,17 +2032,175 @@ Chossing no {if_matches[0].group(1)}.
             "--report-file",
             help="Report output file name",
         )
+        parser.add_argument(
+            "--parquet-file",
+            help="Parquet report output file name (needs pyarrow)",
+        )
         parser.add_argument(
             "--stdout-regex",
             help="regex for filtering stdout",
         )
+        parser.add_argument(
+            "--stdout-patterns",
+            help="file of [name] literal / [name] re:regex patterns filtering and"
+            " tagging stdout, reloaded on SIGHUP",
+        )
+        parser.add_argument(
+            "--bench-patterns",
+            help="benchmark --stdout-patterns against --stdout-regex on N lines",
+            type=int,
+        )
+        parser.add_argument(
+            "--flush-interval",
+            help="max seconds lines stay buffered before stdout/report write",
+            default=0.5,
+            type=float,
+        )
+        parser.add_argument(
+            "--compress-rotated",
+            help="gzip the rotated report files",
+            action="store_true",
+        )
+
+        parser.add_argument(
+            "--native",
+            help="decode -r/--from-file in process, without tshark "
+            f"({', '.join(NativeDecoder.PROFILES)})",
+            action="store_true",
+        )
+
+        parser.add_argument(
+            "--reorder-window",
+            help="several interfaces, seconds records wait to be merged in time order",
+            default=0.5,
+            type=float,
+        )
+        parser.add_argument(
+            "--reassemble",
+            help="tcp_tap/udp_tap, reassemble and frame the payload into one record per"
+            " message: newline, stx-etx, length:2, length:4[:le] or none",
+        )
+        parser.add_argument(
+            "--reassemble-buffer",
+            help="max bytes buffered per stream direction",
+            default=1 << 16,
+            type=int,
+        )
+        parser.add_argument(
+            "--reassemble-max-streams",
+            help="max stream directions kept, the oldest are evicted",
+            default=10000,
+            type=int,
+        )
+        parser.add_argument(
+            "--reassemble-idle",
+            help="seconds after which an idle stream direction is evicted",
+            default=60.0,
+            type=float,
+        )
+        parser.add_argument(
+            "--dashboard",
+            help="live metrics refreshed every second, averaged over N seconds",
+            nargs="?",
+            const=10,
+            type=int,
+        )
+        parser.add_argument(
+            "--dashboard-top",
+            help="dashboard top-N size",
+            default=10,
+            type=int,
+        )
+        parser.add_argument(
+            "--dashboard-http",
+            help="serve the dashboard as JSON on http://127.0.0.1:PORT/",
+            type=int,
+        )
+        parser.add_argument(
+            "--sip-correlate",
+            help="sip profile, correlate dialogs / transactions and log SIP summaries",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--sip-max-dialogs",
+            help="max dialogs / transactions / registrations kept in memory",
+            default=100000,
+            type=int,
+        )
+        parser.add_argument(
+            "--sip-stats-interval",
+            help="seconds (capture time) between SIP rolling percentiles",
+            default=60.0,
+            type=float,
+        )
 
         result, extra_args = parser.parse_known_args()
-        if not (result.from_file or result.interface):
-            parser.error("-i/--interface or -r/--from-file need to be present")
-        elif result.from_file and result.interface:
-            parser.error("-i/--interface and -r/--from-file cannot be both present")
+        if result.bench_patterns:
+            if not result.stdout_patterns:
+                parser.error("--bench-patterns needs --stdout-patterns")
+            StdoutPatterns(result.stdout_patterns).benchmark(result.bench_patterns)
+            exit(0)
+        if result.stdout_patterns and result.stdout_regex:
+            parser.error("--stdout-patterns and --stdout-regex cannot be both present")
+        sources = [result.interface, result.from_file, result.from_glob]
+        if not any(sources):
+            parser.error(
+                "-i/--interface, -r/--from-file or --from-glob need to be present"
+            )
+        elif len([s for s in sources if s]) > 1:
+            parser.error(
+                "only one of -i/--interface, -r/--from-file, --from-glob can be present"
+            )
+        specs = []
+        for spec in result.interface or []:
+            interface, _, profile = spec.rpartition(":")
+            if interface and profile in MyTshark.PROTOCOLS:
+                specs.append((interface, profile))
+            else:
+                specs.append((spec, result.protocol))
+        if len(specs) == 1:
+            result.interface, result.protocol = specs[0]
+        elif specs:
+            profiles = {profile for _, profile in specs}
+            if len(profiles) == 1:
+                result.protocol = profiles.pop()
+            elif result.parquet_file or result.sip_correlate:
+                parser.error(
+                    "--parquet-file and --sip-correlate need the same profile"
+                    " on all the interfaces"
+                )
+            if result.reassemble:
+                parser.error("--reassemble cannot merge streams of several interfaces")
+        if result.from_glob and result.time_format in ("r", "d", "dd"):
+            parser.error("--from-glob needs an absolute --time-format")
+        if result.reassemble:
+            if result.protocol not in ("tcp_tap", "udp_tap"):
+                parser.error("--reassemble needs -p tcp_tap or -p udp_tap")
+            try:
+                StreamReassembler.make_framer(result.reassemble)
+            except ValueError as e:
+                parser.error(f"--reassemble {e}")
+        if result.parquet_file and pa is None:
+            parser.error("--parquet-file needs pyarrow, pip install pyarrow")
+        if result.dashboard_http and not result.dashboard:
+            result.dashboard = 10
+        if result.dashboard is not None and result.dashboard < 2:
+            parser.error("--dashboard window needs at least 2 seconds")
+        if result.sip_correlate and result.protocol != "sip":
+            parser.error("--sip-correlate needs -p sip")
+        reading = result.from_file or result.from_glob
+        if result.capture_filter and reading and not result.native:
+            parser.error("-f/--capture-filter cannot filter files, use -Y instead")
+        if result.native:
+            if not (result.from_file or result.from_glob):
+                parser.error("--native needs -r/--from-file or --from-glob")
+            if result.protocol not in NativeDecoder.PROFILES:
+                parser.error(f"--native does not support protocol {result.protocol}")
+            if extra_args:
+                parser.error(f"--native cannot pass {extra_args} to tshark")
 
+        if len(specs) > 1:
+            return CaptureSupervisor(result, extra_args, specs)
         return MyTshark(result, extra_args)
 
 
@@ -268,6 +2208,8 @@ def main():
     logging.basicConfig(
         format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO
     )
+    # SIGTERM exits through the same path as Ctrl-C, flushing the report
+    signal(SIGTERM, default_int_handler)
     my_tshark = MyTshark.parse_args()
     my_tshark.run()
 